@@ -6,9 +6,12 @@ from flask_cors import CORS
 from app.utils.config import config  
 from flask_migrate import Migrate 
 from app.utils.ai_helper_methods import load_faiss_index, clear_faiss_index
+from app.utils.embedding_model import warm_up_model
+from app.utils.reranker import warm_up_reranker
 from app.utils.setup_nltk import download_nltk
 from flask_caching import Cache
 import click
+import multiprocessing
 from werkzeug.security import generate_password_hash
 
 
@@ -30,8 +33,15 @@ def create_app():
     db.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db) 
-    load_faiss_index()
-    # clear_faiss_index()
+    # Processes spawned by multiprocessing (the reindex embedding pool) import the app only to reach
+    # their task functions, so they skip loading the index and the warm-ups
+    if multiprocessing.parent_process() is None:
+        load_faiss_index()
+        # clear_faiss_index()
+        if config.EMBEDDING_WARMUP:
+            warm_up_model()
+        if config.RERANK_ENABLED:
+            warm_up_reranker()
     download_nltk()
 
     
@@ -40,12 +50,14 @@ def create_app():
     from app.routes.user import user_bp
     from app.routes.message import message_bp
     from app.routes.chat import chat_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(documents_bp)
     app.register_blueprint(user_bp)
     app.register_blueprint(message_bp)
     app.register_blueprint(chat_bp)
+    app.register_blueprint(metrics_bp)
 
     return app
 
@@ -77,7 +89,98 @@ def create_superuser(name, email, password, department):
     print(f"Superuser '{name}' created successfully.")
 
 
-    
-    
-
+@app.cli.command("rebuild-index")
+def rebuild_index():
+    """Rebuild the FAISS index from the chunk vectors stored in the database."""
+    from app.utils.ai_helper_methods import rebuild_faiss_index_from_store
+
+    total = rebuild_faiss_index_from_store()
+    print(f"FAISS index rebuilt with {total} vectors.")
+
+
+@app.cli.command("reindex")
+@click.option("--workers", default=0, help="Embedding processes (0 for one per CPU).")
+@click.option("--batch-size", default=256, help="Texts per embedding task.")
+@click.option("--page-size", default=200, help="Documents fetched per server-side cursor page.")
+@click.option("--rechunk", is_flag=True, help="Re-split every document instead of only those without chunks.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint of an interrupted run.")
+def reindex(workers, batch_size, page_size, rechunk, restart):
+    """Chunk, embed and rebuild the FAISS index from the document tables (resumable)."""
+    import os
+    from app.utils.reindex import reindex_documents
+
+    stats = reindex_documents(
+        workers=workers or os.cpu_count() or 1,
+        batch_size=batch_size,
+        page_size=page_size,
+        rechunk=rechunk,
+        restart=restart,
+        report=print,
+    )
+    print("Reindex complete: " + ", ".join(f"{key}={value}" for key, value in stats.items()))
+
+
+@app.cli.command("chat-worker")
+@click.option("--threads", default=4, help="Chat jobs run concurrently by this process.")
+@click.option("--report-every", default=60, help="Seconds between queue statistics reports.")
+def chat_worker(threads, report_every):
+    """Run queued asynchronous chat jobs until interrupted."""
+    import threading
+    from app.services.chat_job_service import start_workers, queue_stats
+    from app.utils.metrics import snapshot
+
+    stop = threading.Event()
+    workers = start_workers(app, threads, stop)
+    print(f"Chat worker running {threads} threads; press Ctrl+C to stop.")
+    try:
+        while not stop.wait(report_every):
+            timings = snapshot()["timings"]
+            wait, run = timings.get("chat_jobs.wait", {}), timings.get("chat_jobs.run", {})
+            print(f"Chat jobs: {queue_stats()}, wait p50={wait.get('p50_ms')}ms p99={wait.get('p99_ms')}ms, "
+                  f"run p50={run.get('p50_ms')}ms, completed={run.get('count', 0)}")
+    except KeyboardInterrupt:
+        stop.set()
+        print("Chat worker stopping after the jobs in progress.")
+        for worker in workers:
+            worker.join()
+
+
+@app.cli.command("bench-cache")
+@click.option("--iterations", default=1000, help="Number of decodes per format.")
+def bench_cache(iterations):
+    """Benchmark the embedding cache encoding against the legacy str()/eval() format."""
+    from app.utils.benchmarks import benchmark_cache_codec
+    from app.utils.redis import redis_client
+
+    results = benchmark_cache_codec(iterations=iterations, redis_client=redis_client)
+    for name, result in results.items():
+        print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+
+@app.cli.command("bench-index")
+@click.option("--types", default="hnsw,hnsw_sq8,ivf_flat,ivf_sq8,ivf_pq,sq8,sq_fp16", help="Comma separated index types to compare.")
+@click.option("--queries", default=200, help="Number of held-out query vectors.")
+@click.option("--k", default=10, help="Neighbours per query used for recall.")
+@click.option("--limit", default=0, help="Use at most this many stored vectors (0 for all).")
+def bench_index(types, queries, k, limit):
+    """Benchmark FAISS index types on the stored chunk embeddings (recall@k, latency, memory)."""
+    import numpy as np
+    from app.utils.benchmarks import benchmark_index
+    from app.utils.vector_store import iter_stored_embeddings
+
+    batches, total = [], 0
+    for _, vectors, _ in iter_stored_embeddings():
+        batches.append(vectors)
+        total += len(vectors)
+        if limit and total >= limit:
+            break
+    if not batches:
+        print("No stored embeddings to benchmark.")
+        return
 
+    vectors = np.vstack(batches)[:limit or None]
+    print(f"Benchmarking on {len(vectors)} stored vectors.")
+    results = benchmark_index(vectors, [t.strip() for t in types.split(",") if t.strip()], num_queries=queries, k=k,
+                              train_sample=config.FAISS_TRAIN_SAMPLE)
+    for name, result in results.items():
+        print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
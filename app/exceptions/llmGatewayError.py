@@ -0,0 +1,10 @@
+class LLMGatewayError(Exception):
+    pass
+
+
+class LLMTimeoutError(LLMGatewayError):
+    pass
+
+
+class LLMBusyError(LLMGatewayError):
+    pass
@@ -8,6 +8,9 @@ class Chat(db.Model):
     session_id = db.Column(db.String(36), nullable=False)
     name = db.Column(db.String(255), nullable=True) 
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Rolling summary of the conversation up to and including message summarized_through
+    summary = db.Column(db.Text, nullable=True)
+    summarized_through = db.Column(db.Integer, nullable=True)
 
     messages = db.relationship('Message', back_populates='chat', cascade='all, delete-orphan')
 
@@ -1,6 +1,8 @@
 from .database import db
 from datetime import datetime
 from sqlalchemy import UniqueConstraint
+from sqlalchemy.orm import deferred
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 class Document(db.Model):
     __tablename__ = 'documents'
@@ -225,4 +227,52 @@ class SalesDocument(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     content = db.Column(db.Text, nullable=False)
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    uploader = db.relationship('User', backref='sales_documents')
\ No newline at end of file
+    uploader = db.relationship('User', backref='sales_documents')
+
+class DocumentChunk(db.Model):
+    
+    __tablename__ = 'document_chunks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_table = db.Column(db.String(64), nullable=False)
+    document_id = db.Column(db.Integer, nullable=False)
+    doc_key = db.Column(db.BigInteger, nullable=False, index=True)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    scope = db.Column(db.String(100), nullable=False, index=True)
+    section = db.Column(db.String(255), nullable=True)
+    content = db.Column(db.Text, nullable=False)
+    # Only the index rebuild reads the vector, and it selects the column explicitly
+    embedding = deferred(db.Column(db.LargeBinary, nullable=True))
+    embedding_model = db.Column(db.String(255), nullable=True)
+    # Maintained by Postgres for lexical search; the text search config must match LEXICAL_TS_CONFIG
+    search_vector = deferred(db.Column(
+        TSVECTOR,
+        db.Computed("to_tsvector('english', coalesce(section, '') || ' ' || content)", persisted=True)
+    ))
+    
+    __table_args__ = (
+        db.Index('ix_document_chunks_document', 'document_table', 'document_id'),
+        db.Index('ix_document_chunks_search_vector', 'search_vector', postgresql_using='gin'),
+    )
+
+
+DEPARTMENT_DOCUMENT_MODELS = {
+    'hr': HRDocument,
+    'it': ITDocument,
+    'reconciliation': ReconciliationDocument,
+    'marketing': MarketingDocument,
+    'transformation': TransformationDocument,
+    'communication': CommunicationDocument,
+    'internal_operations': InternalOperationDocument,
+    'legal': LegalDocument,
+    'accounts': AccountDocument,
+    'portfolio_risk': PortfolioRiskDocument,
+    'underwriting': UnderwriterDocument,
+    'business_operations': BusinessOperationDocument,
+    'client_experience': ClientExperienceDocument,
+    'recovery': RecoveryDocument,
+    'product': ProductDocument,
+    'sales': SalesDocument,
+}
+
+DEPARTMENT_BY_TABLE = {model.__tablename__: department for department, model in DEPARTMENT_DOCUMENT_MODELS.items()}
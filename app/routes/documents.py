@@ -25,6 +25,7 @@ from app.models.document import (
     RecoveryDocument,
     ProductDocument,
     SalesDocument,
+    DEPARTMENT_DOCUMENT_MODELS,
 )
 from app.services.file_processing import (
     save_file, 
@@ -47,7 +48,8 @@ from app.services.file_processing import (
     save_transformation_files, 
     save_underwriter_files
 )
-from app.utils.ai_helper_methods import add_doc_with_id_to_faiss
+from app.utils.ai_helper_methods import index_document, delete_document, replace_document
+from app.utils.document_locator import encode_doc_key, locate_document, load_located_document, document_owner_id
 from app.utils.logger import logger
 
 
@@ -125,7 +127,7 @@ def upload_document():
             else:
                 return jsonify({"error": "Invalid department"}), 400
 
-        add_doc_with_id_to_faiss(document.content, document.id)
+        index_document(document, response.get("sections"))
 
         return jsonify({
             "message": f"Document uploaded successfully with {visibility} visibility",
@@ -340,17 +342,23 @@ def get_accessible_documents():
             ).filter(Document.user_id == user_id).all()
 
 
-        # Combine all documents
-        accessible_documents = general_documents + department_documents + user_documents
+        # Combine all documents, keeping the table each came from for its global document key
+        department_model = DEPARTMENT_DOCUMENT_MODELS.get(user_department)
+        accessible_documents = (
+            [(GeneralDocument.__tablename__, doc) for doc in general_documents]
+            + [(department_model.__tablename__, doc) for doc in department_documents]
+            + [(Document.__tablename__, doc) for doc in user_documents]
+        )
 
         # Convert to a list of dictionaries
         documents_list = [{
             "id": doc.id,
+            "doc_key": encode_doc_key(document_table, doc.id),
             "file_name": doc.file_name,
             "file_type": doc.file_type,
             "upload_date": doc.upload_date.strftime('%Y-%m-%d %H:%M:%S'),
             "uploader": doc.uploader  # Include uploader's name
-        } for doc in accessible_documents]
+        } for document_table, doc in accessible_documents]
 
         return jsonify({"documents": documents_list}), 200
 
@@ -383,8 +391,8 @@ def download_document(document_id):
             'xls': 'application/vnd.ms-excel'
         }
         
-        # Try to fetch a general document first
-        document = GeneralDocument.query.filter_by(id=document_id).first()
+        # Resolve the id (a global document key or a plain row id) across accessible tables in one query
+        document = locate_document(document_id, user_id, user_department)
         if document:
             file_ext = document.file_type.lower() if document.file_type else 'txt'
             mimetype = mimetypes.get(file_ext, 'text/plain')
@@ -395,68 +403,6 @@ def download_document(document_id):
                 mimetype=mimetype,
                 as_attachment=True
             )
-
-        # Check department-specific documents
-        if user_department == 'hr':
-            document = HRDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'it':
-            document = ITDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'reconciliation':
-            document = ReconciliationDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'marketing':
-            document = MarketingDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'transformation':
-            document = TransformationDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'communication':
-            document = CommunicationDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'internal_operations':
-            document = InternalOperationDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'legal':
-            document = LegalDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'accounts':
-            document = AccountDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'portfolio_risk':
-            document = PortfolioRiskDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'underwriting':
-            document = UnderwriterDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'business_operations':
-            document = BusinessOperationDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'client_experience':
-            document = ClientExperienceDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'recovery':
-            document = RecoveryDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'product':
-            document = ProductDocument.query.filter_by(id=document_id).first()
-        elif user_department == 'sales':
-            document = SalesDocument.query.filter_by(id=document_id).first()
-        else:
-            document = None
-
-        if document:
-            file_ext = document.file_type.lower() if document.file_type else 'txt'
-            mimetype = mimetypes.get(file_ext, 'text/plain')
-            content_bytes = generate_file_content(document)
-            return send_file(
-                content_bytes,
-                download_name=document.file_name,
-                mimetype=mimetype,
-                as_attachment=True
-            )
-        
-        #check if the document is user-specific
-        document = Document.query.filter_by(id=document_id, user_id=user_id).first()
-       
-        if document:
-            file_ext = document.file_type.lower() if document.file_type else 'txt'
-            mimetype = mimetypes.get(file_ext)
-            logger.info(mimetype)
-            content_bytes = generate_file_content(document)
-            return send_file(
-                content_bytes,
-                download_name=document.file_name,
-                mimetype=mimetype,
-                as_attachment=True
-            )
         
         return jsonify({"error": "Document not found or access denied"}), 404
 
@@ -465,6 +411,90 @@ def download_document(document_id):
         return jsonify({"error": str(e)}), 500
     
 
+def _find_editable_document(document_id, session_response):
+    """
+    Returns the accessible document the user uploaded (any accessible document for superusers), or None.
+    A plain id resolves to the user's personal document first, then to the shared ones they uploaded.
+    """
+    row = locate_document(
+        document_id, session_response.get("user_id"), session_response.get("department"), columns=(),
+        owned_only=not session_response.get("is_superuser"), personal_first=True,
+    )
+    if row is None:
+        return None
+    document = load_located_document(row)
+    if document is None:
+        return None
+    if not session_response.get("is_superuser") and document_owner_id(document) != session_response.get("user_id"):
+        return None
+    return document
+
+
+@documents_bp.route('/<int:document_id>', methods=['OPTIONS', 'DELETE'])
+@jwt_required()
+def remove_document(document_id):
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    identity = get_jwt_identity()
+    session_response = verify_session(identity)
+    if "error" in session_response:
+        return jsonify(session_response), 401
+
+    try:
+        document = _find_editable_document(document_id, session_response)
+        if document is None:
+            return jsonify({"error": "Document not found or access denied"}), 404
+
+        delete_document(document)
+        return jsonify({"message": "Document deleted successfully"}), 200
+    except Exception as e:
+        logger.error(f"Error deleting document: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@documents_bp.route('/<int:document_id>', methods=['OPTIONS', 'PUT'])
+@jwt_required()
+def update_document(document_id):
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    identity = get_jwt_identity()
+    session_response = verify_session(identity)
+    if "error" in session_response:
+        return jsonify(session_response), 401
+
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    try:
+        document = _find_editable_document(document_id, session_response)
+        if document is None:
+            return jsonify({"error": "Document not found or access denied"}), 404
+
+        compressed_file = compress_doc(request.files["file"])
+        response = validate_file(compressed_file)
+        if "error" in response:
+            return jsonify(response), 400
+
+        replace_document(
+            document,
+            response.get("text"),
+            response.get("sections"),
+            file_name=compressed_file.filename,
+            file_type=response.get("file_extension"),
+        )
+
+        return jsonify({
+            "message": "Document replaced successfully",
+            "file_name": document.file_name,
+            "file_type": document.file_type,
+        }), 200
+    except Exception as e:
+        logger.error(f"Error replacing document: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 def generate_file_content(document):
             file_ext = document.file_type.lower() if document.file_type else 'txt'
             if file_ext == 'docx':
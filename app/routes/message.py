@@ -1,15 +1,16 @@
 from flask import Blueprint, request, jsonify, Flask
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.utils.verify_session import verify_session
-from app.services.message_service import send_message_receive_response
+from app.services.message_service import send_message_receive_response, stream_message_response, update_full_messages
+from app.services.chat_job_service import submit_job, get_job, wait_for_job, has_live_workers, PENDING_STATUSES
 from app.utils.logger import logger
-from flask import jsonify, request, send_file
+from app.utils.config import config
+from flask import jsonify, request, send_file, Response, stream_with_context
 from io import BytesIO
+from contextlib import closing
+from redis.exceptions import RedisError
 from gtts import gTTS
-from app.models.database import db
-from app.models.message import Message
 import json
-from datetime import datetime
 
 
 
@@ -39,6 +40,12 @@ def message():
    if not user_id:
         return jsonify({"error": "User ID not found in session."}), 401
    
+   if request.json.get('async'):
+        return _queue_job("message", user_id, {
+            "user_query": user_message, "current_user": identity, "user_id": user_id, "chat_id": chat_id,
+            "session_id": session_id, "user_department": user_department,
+        })
+
    chat_response = send_message_receive_response(user_message, identity, user_id, chat_id, session_id, user_department, is_update=False)
    if "error" in chat_response:
         return jsonify(chat_response), 500
@@ -46,6 +53,63 @@ def message():
         return jsonify(chat_response), 200
     
 
+def _queue_job(kind, user_id, payload):
+    try:
+        # Without in-process workers the job only runs if a `flask chat-worker` process is up
+        if config.CHAT_JOB_WORKERS <= 0 and not has_live_workers():
+            logger.error(f"Could not queue {kind} chat job: no chat workers are running")
+            return jsonify({"error": "Chat jobs are temporarily unavailable"}), 503
+        job_id = submit_job(kind, user_id, payload)
+    except RedisError as e:
+        logger.error(f"Could not queue {kind} chat job: {e}")
+        return jsonify({"error": "Chat jobs are temporarily unavailable"}), 503
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@message_bp.route('/messages/stream', methods=["OPTIONS", "POST"])
+@jwt_required()
+def stream_message():
+    """
+    Streams the answer as Server-Sent Events: "token" events ({"text": ...}) as the model produces them,
+    then a "done" event with the saved messages, or an "error" event.
+    """
+    if request.method == 'OPTIONS':
+        return ' ', 204
+
+    user_message = request.json.get('user_message', '').strip()
+    chat_id = request.json.get('chat_id')
+    if not user_message:
+        return jsonify({"error": "Query cannot be empty."}), 400
+
+    identity = get_jwt_identity()
+    session_response = verify_session(identity)
+    if "error" in session_response:
+        return jsonify(session_response), 401
+
+    user_id = session_response.get("user_id")
+    session_id = session_response.get("session_id")
+    user_department = session_response.get("department")
+    if not user_id:
+        return jsonify({"error": "User ID not found in session."}), 401
+
+    def events():
+        # Closed explicitly on disconnect, while the request context is still there to save the partial answer
+        with closing(stream_message_response(user_message, identity, user_id, chat_id, session_id, user_department)) as stream:
+            for event, data in stream:
+                yield _sse(event, {"text": data} if event == "token" else data)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Keep proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @message_bp.route('/messages/update_full', methods=['PUT'])
 @jwt_required()
 def update_full():
@@ -63,72 +127,101 @@ def update_full():
     if not user_message_id or not ai_message_id or not new_content:
         return jsonify({"error": "userMessageId, aiMessageId and newContent are required"}), 400
 
-    # Fetch both the user message and the AI message from the database
-    user_message = Message.query.get(user_message_id)
-    ai_message = Message.query.get(ai_message_id)
+    identity = get_jwt_identity()
+    session_response = verify_session(identity)
+    if "error" in session_response:
+        return jsonify(session_response), 401
+
+    user_id = session_response.get("user_id")
+    session_id = session_response.get("session_id")
+    user_department = session_response.get("department")
+
+    if data.get('async'):
+        return _queue_job("update_full", user_id, {
+            "user_message_id": user_message_id, "ai_message_id": ai_message_id, "new_content": new_content,
+            "current_user": identity, "user_id": user_id, "session_id": session_id, "user_department": user_department,
+        })
+
+    response, status = update_full_messages(
+        user_message_id, ai_message_id, new_content, identity, user_id, session_id, user_department
+    )
+    return jsonify(response), status
+
 
-    if not user_message or not ai_message:
-        return jsonify({"error": "User or AI Message not found"}), 404
+def _find_own_job(job_id):
+    """
+    Returns (job, None) for a job of the session's user, or (None, error response).
+    """
+    identity = get_jwt_identity()
+    session_response = verify_session(identity)
+    if "error" in session_response:
+        return None, (jsonify(session_response), 401)
 
     try:
-        # ------------------------
-        # Update the User Message
-        # ------------------------
-        user_edits = json.loads(user_message.edits) if user_message.edits else []
-        # Append current version before updating
-        user_edits.append({
-            'content': user_message.content,
-            'timestamp': user_message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        })
-        user_message.edits = json.dumps(user_edits)
-        user_message.edit_count += 1
-        user_message.content = new_content
-        user_message.timestamp = datetime.utcnow()
-
-        # ---------------------------------------
-        # Regenerate the AI Response for the edit
-        # ---------------------------------------
-        identity = get_jwt_identity()
-        session_response = verify_session(identity)
-        if "error" in session_response:
-            return jsonify(session_response), 401
-
-        user_id = session_response.get("user_id")
-        session_id = session_response.get("session_id")
-        user_department = session_response.get("department")
+        job = get_job(job_id)
+    except RedisError as e:
+        logger.error(f"Could not read chat job {job_id}: {e}")
+        return None, (jsonify({"error": "Chat jobs are temporarily unavailable"}), 503)
+    if job is None or job["user_id"] != session_response.get("user_id"):
+        return None, (jsonify({"error": "Job not found"}), 404)
+    return job, None
 
-        chat_response = send_message_receive_response(
-            new_content, identity, user_id, user_message.chat_id, session_id, user_department, is_update=True
-        )
-        if "error" in chat_response:
-            return jsonify(chat_response), 500
 
-        # ------------------------
-        # Update the AI Message
-        # ------------------------
-        ai_edits = json.loads(ai_message.edits) if ai_message.edits else []
-        # Save the current AI response version before updating
-        ai_edits.append({
-            'content': ai_message.content,
-            'timestamp': ai_message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        })
-        ai_message.edits = json.dumps(ai_edits)
-        ai_message.edit_count += 1
-        ai_message.content = chat_response["answer"]
-        ai_message.timestamp = datetime.utcnow()
+@message_bp.route('/jobs/<job_id>', methods=["OPTIONS", "GET"])
+@jwt_required()
+def chat_job(job_id):
+    """
+    Returns the status of an asynchronous chat job and, once it has finished, its result.
+    With ?wait=<seconds> (at most CHAT_JOB_MAX_WAIT) the request waits for the job to finish first,
+    holding a sync web worker meanwhile, so keep the cap short unless gunicorn runs gevent workers.
+    """
+    if request.method == 'OPTIONS':
+        return ' ', 204
 
-        db.session.commit()
+    job, error = _find_own_job(job_id)
+    if error:
+        return error
 
-        return jsonify({
-            "message": "Messages updated successfully",
-            "updated_user_message": user_message.to_dict(),
-            "updated_ai_message": ai_message.to_dict()
-        }), 200
+    wait = min(request.args.get('wait', 0, type=float), config.CHAT_JOB_MAX_WAIT)
+    if wait > 0 and job["status"] in PENDING_STATUSES:
+        try:
+            job = wait_for_job(job_id, wait) or job
+        except RedisError as e:
+            logger.error(f"Could not wait for chat job {job_id}: {e}")
+    return jsonify(job), 200
 
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Failed to update messages: {e}", exc_info=True)
-        return jsonify({"error": "Failed to update messages"}), 500
+
+@message_bp.route('/jobs/<job_id>/events', methods=["GET"])
+@jwt_required()
+def chat_job_events(job_id):
+    """
+    Subscribes to an asynchronous chat job: sends a "status" event, then a "done" event with the job once
+    it finishes (or a "pending" event after CHAT_JOB_MAX_WAIT seconds, after which the client reconnects).
+    Like ?wait on the status route, an open stream holds a sync web worker.
+    """
+    job, error = _find_own_job(job_id)
+    if error:
+        return error
+
+    def events():
+        yield _sse("status", job)
+        try:
+            finished = wait_for_job(job_id, config.CHAT_JOB_MAX_WAIT) if job["status"] in PENDING_STATUSES else job
+        except RedisError as e:
+            logger.error(f"Could not wait for chat job {job_id}: {e}")
+            finished = job
+        if finished is None:
+            yield _sse("error", {"error": "Job not found"})
+        elif finished["status"] in PENDING_STATUSES:
+            yield _sse("pending", finished)
+        else:
+            yield _sse("done", finished)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @message_bp.route('/voice', methods=["OPTIONS", "POST"])
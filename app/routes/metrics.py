@@ -0,0 +1,38 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.utils.verify_session import verify_session
+from app.utils.metrics import snapshot
+from app.utils import ai_helper_methods
+from app.services.chat_job_service import queue_stats
+from redis.exceptions import RedisError
+
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+
+@metrics_bp.route('', methods=["OPTIONS", "GET"])
+@jwt_required()
+def get_metrics():
+    """
+    Returns the in-process performance metrics of the worker that serves the request.
+    """
+    if request.method == 'OPTIONS':
+        return ' ', 204
+
+    identity = get_jwt_identity()
+    session_response = verify_session(identity)
+    if "error" in session_response:
+        return jsonify(session_response), 401
+
+    if not session_response.get("is_superuser"):
+        return jsonify({"error": "Access denied"}), 403
+
+    metrics = snapshot()
+    if ai_helper_methods.vector_index is not None:
+        metrics["index_partitions"] = ai_helper_methods.vector_index.counts()
+    try:
+        metrics["chat_jobs"] = queue_stats()
+    except RedisError as e:
+        metrics["chat_jobs"] = {"error": str(e)}
+
+    return jsonify(metrics), 200
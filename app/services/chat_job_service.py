@@ -0,0 +1,330 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from flask import current_app
+from redis.exceptions import RedisError
+from app.utils.config import config
+from app.utils.logger import logger
+from app.utils import metrics
+from app.utils.redis import redis_client
+from app.services.message_service import send_message_receive_response, update_full_messages
+
+
+QUEUE_KEY = "chat_jobs:queue"
+# Ids of the worker threads that may hold a job in their processing list
+WORKERS_KEY = "chat_jobs:workers"
+
+# A worker whose heartbeat is older than HEARTBEAT_TTL seconds is presumed dead and its job is requeued
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TTL = 30
+
+PENDING_STATUSES = ("queued", "running")
+
+
+def job_key(job_id):
+    return f"chat_job:{job_id}"
+
+
+def _done_channel(job_id):
+    return f"chat_job:{job_id}:done"
+
+
+def _processing_key(worker_id):
+    return f"chat_jobs:processing:{worker_id}"
+
+
+def _heartbeat_key(worker_id):
+    return f"chat_jobs:heartbeat:{worker_id}"
+
+
+def _run_message(payload):
+    result = send_message_receive_response(is_update=False, **payload)
+    return result, 500 if "error" in result else 200
+
+
+def _run_update_full(payload):
+    return update_full_messages(**payload)
+
+
+# Job kinds and the functions that run them; each returns (result, status code)
+JOB_HANDLERS = {
+    "message": _run_message,
+    "update_full": _run_update_full,
+}
+
+
+def submit_job(kind, user_id, payload):
+    """
+    Queues a chat job for the background workers and returns its id. payload holds the keyword
+    arguments of the job's handler and must be JSON serializable.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown chat job kind: {kind}")
+
+    job_id = uuid.uuid4().hex
+    pipeline = redis_client.pipeline()
+    pipeline.hset(job_key(job_id), mapping={
+        "kind": kind,
+        "user_id": user_id,
+        "status": "queued",
+        "payload": json.dumps(payload),
+        "enqueued_at": time.time(),
+    })
+    pipeline.expire(job_key(job_id), config.CHAT_JOB_TTL)
+    pipeline.lpush(QUEUE_KEY, job_id)
+    pipeline.execute()
+
+    metrics.increment("chat_jobs.submitted")
+    if config.CHAT_JOB_WORKERS > 0:
+        _in_process_workers.ensure_started()
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Returns the public view of a job (status, timestamps and, once finished, its result), or None if it
+    doesn't exist or has expired.
+    """
+    data = redis_client.hgetall(job_key(job_id))
+    if not data:
+        return None
+    data = {key.decode(): value.decode() for key, value in data.items()}
+
+    job = {
+        "job_id": job_id,
+        "kind": data["kind"],
+        "status": data["status"],
+        "user_id": int(data["user_id"]),
+        "enqueued_at": float(data["enqueued_at"]),
+    }
+    for field in ("started_at", "finished_at"):
+        if field in data:
+            job[field] = float(data[field])
+    if "result" in data:
+        job["result"] = json.loads(data["result"])
+        job["status_code"] = int(data["status_code"])
+    return job
+
+
+def wait_for_job(job_id, timeout):
+    """
+    Waits up to timeout seconds for a job to finish and returns it (still pending if it didn't).
+    """
+    deadline = time.monotonic() + timeout
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        # Subscribe before reading the status, so a job finishing in between isn't missed
+        pubsub.subscribe(_done_channel(job_id))
+        job = get_job(job_id)
+        while job is not None and job["status"] in PENDING_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            pubsub.get_message(timeout=min(1.0, remaining))
+            job = get_job(job_id)
+        return job
+    finally:
+        pubsub.close()
+
+
+def queue_stats():
+    """
+    Returns the number of queued and running jobs and how long the oldest queued one has been waiting, in seconds.
+    """
+    depth = redis_client.llen(QUEUE_KEY)
+    running = sum(redis_client.llen(_processing_key(worker_id.decode())) for worker_id in redis_client.smembers(WORKERS_KEY))
+    oldest_wait = 0.0
+    # Workers pop from the right, so the oldest job is the last element
+    oldest = redis_client.lindex(QUEUE_KEY, -1)
+    if oldest is not None:
+        enqueued_at = redis_client.hget(job_key(oldest.decode()), "enqueued_at")
+        if enqueued_at is not None:
+            oldest_wait = max(0.0, time.time() - float(enqueued_at))
+    return {"queue_depth": depth, "running": running, "oldest_wait_seconds": round(oldest_wait, 3)}
+
+
+def has_live_workers():
+    """
+    Returns whether any registered worker thread still has a live heartbeat, i.e. whether a queued job will be run.
+    """
+    members = redis_client.smembers(WORKERS_KEY)
+    if not members:
+        return False
+    pipeline = redis_client.pipeline()
+    for member in members:
+        pipeline.exists(_heartbeat_key(member.decode()))
+    return any(pipeline.execute())
+
+
+def requeue_stale_jobs():
+    """
+    Puts the jobs held by worker threads that stopped heartbeating (a crashed, killed or restarted worker)
+    back on the queue. Returns the number of jobs requeued.
+    """
+    requeued = 0
+    for member in redis_client.smembers(WORKERS_KEY):
+        worker_id = member.decode()
+        if redis_client.exists(_heartbeat_key(worker_id)):
+            continue
+        # RPOPLPUSH moves each job atomically, so concurrent reapers never requeue it twice
+        while True:
+            job_id = redis_client.rpoplpush(_processing_key(worker_id), QUEUE_KEY)
+            if job_id is None:
+                break
+            job_id = job_id.decode()
+            if redis_client.hexists(job_key(job_id), "kind"):
+                redis_client.hset(job_key(job_id), "status", "queued")
+            logger.warning(f"Requeued chat job {job_id} from unresponsive worker {worker_id}")
+            requeued += 1
+        redis_client.srem(WORKERS_KEY, worker_id)
+    if requeued:
+        metrics.increment("chat_jobs.requeued", requeued)
+    return requeued
+
+
+def _store_result(job_id, result, status_code):
+    key = job_key(job_id)
+    pipeline = redis_client.pipeline()
+    pipeline.hset(key, mapping={
+        "status": "done" if status_code < 400 else "failed",
+        "result": json.dumps(result),
+        "status_code": status_code,
+        "finished_at": time.time(),
+    })
+    pipeline.expire(key, config.CHAT_JOB_TTL)
+    pipeline.publish(_done_channel(job_id), "done")
+    pipeline.execute()
+
+
+def run_job(app, job_id):
+    """
+    Runs one queued job in its own app context and stores its result.
+    """
+    key = job_key(job_id)
+    data = redis_client.hgetall(key)
+    if not data:
+        logger.warning(f"Chat job {job_id} expired before it could run")
+        metrics.increment("chat_jobs.expired")
+        return
+    data = {field.decode(): value.decode() for field, value in data.items()}
+
+    # A job whose worker died mid-run is requeued; one that keeps taking workers down is failed instead
+    attempts = redis_client.hincrby(key, "attempts", 1)
+    if attempts > config.CHAT_JOB_MAX_ATTEMPTS:
+        logger.error(f"Chat job {job_id} was interrupted {attempts - 1} times, giving up")
+        metrics.increment("chat_jobs.failed")
+        _store_result(job_id, {"error": "The job was interrupted, please try again"}, 500)
+        return
+
+    started_at = time.time()
+    metrics.observe("chat_jobs.wait", started_at - float(data["enqueued_at"]))
+    redis_client.hset(key, mapping={"status": "running", "started_at": started_at})
+
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            result, status_code = JOB_HANDLERS[data["kind"]](json.loads(data["payload"]))
+    except Exception as e:
+        logger.error(f"Chat job {job_id} failed: {e}", exc_info=True)
+        result, status_code = {"error": "Internal server error"}, 500
+    metrics.observe("chat_jobs.run", time.perf_counter() - start)
+    metrics.increment("chat_jobs.completed" if status_code < 400 else "chat_jobs.failed")
+    _store_result(job_id, result, status_code)
+
+
+def _work(app, stop, worker_id):
+    # A taken job stays in the worker's processing list until it has run, so it survives a crash
+    processing = _processing_key(worker_id)
+    while not stop.is_set():
+        try:
+            job_id = redis_client.brpoplpush(QUEUE_KEY, processing, timeout=5)
+        except RedisError as e:
+            logger.error(f"Chat job worker could not read the queue: {e}")
+            stop.wait(1)
+            continue
+        if job_id is None:
+            continue
+        job_id = job_id.decode()
+        try:
+            run_job(app, job_id)
+        except Exception as e:
+            logger.error(f"Chat job worker failed to run job {job_id}: {e}", exc_info=True)
+        try:
+            redis_client.lrem(processing, 1, job_id)
+        except RedisError as e:
+            logger.error(f"Chat job worker could not acknowledge job {job_id}: {e}")
+
+
+def _beat(worker_ids):
+    pipeline = redis_client.pipeline()
+    for worker_id in worker_ids:
+        pipeline.set(_heartbeat_key(worker_id), 1, ex=HEARTBEAT_TTL)
+    pipeline.sadd(WORKERS_KEY, *worker_ids)
+    pipeline.execute()
+
+
+def _heartbeat(worker_ids, workers):
+    """
+    Keeps the workers' heartbeats alive while any of them runs (including a job finishing after stop),
+    and requeues the jobs of dead workers elsewhere.
+    """
+    while any(worker.is_alive() for worker in workers):
+        try:
+            _beat(worker_ids)
+            requeue_stale_jobs()
+        except RedisError as e:
+            logger.error(f"Chat job heartbeat failed: {e}")
+        time.sleep(HEARTBEAT_INTERVAL)
+
+    try:
+        redis_client.delete(*[_heartbeat_key(worker_id) for worker_id in worker_ids])
+        redis_client.srem(WORKERS_KEY, *worker_ids)
+    except RedisError as e:
+        logger.error(f"Could not unregister chat job workers: {e}")
+
+
+def start_workers(app, threads, stop=None):
+    """
+    Starts threads job worker threads in this process. They run until stop (a threading.Event) is set.
+    """
+    stop = stop or threading.Event()
+    prefix = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    worker_ids = [f"{prefix}:{number}" for number in range(max(1, threads))]
+    # Registered with a live heartbeat before any job is taken, so no reaper mistakes them for dead workers
+    _beat(worker_ids)
+
+    workers = [
+        threading.Thread(target=_work, args=(app, stop, worker_id), name=f"chat-job-worker-{number}", daemon=True)
+        for number, worker_id in enumerate(worker_ids)
+    ]
+    for worker in workers:
+        worker.start()
+    threading.Thread(target=_heartbeat, args=(worker_ids, workers), name="chat-job-heartbeat", daemon=True).start()
+    logger.info(f"Started {len(workers)} chat job workers")
+    return workers
+
+
+class _InProcessWorkers:
+    """
+    CHAT_JOB_WORKERS worker threads inside a web process, started on its first submission
+    (and again after a fork), for deployments without a dedicated `flask chat-worker` process.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            start_workers(current_app._get_current_object(), config.CHAT_JOB_WORKERS)
+
+
+_in_process_workers = _InProcessWorkers()
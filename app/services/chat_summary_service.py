@@ -0,0 +1,114 @@
+import threading
+from flask import current_app
+from app.models.database import db
+from app.models.chat import Chat
+from app.models.message import Message
+from app.utils.config import config
+from app.utils.context_packing import estimate_tokens
+from app.utils.logger import logger
+from app.utils import metrics, llm_gateway
+
+
+# Chats with a summary refresh running in a background thread
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _unsummarized_messages(chat):
+    query = Message.query.filter(Message.chat_id == chat.id)
+    if chat.summarized_through is not None:
+        query = query.filter(Message.id > chat.summarized_through)
+    return query.order_by(Message.timestamp, Message.id).all()
+
+
+def _as_history(messages):
+    return [{"sender": "User" if m.sender == "User" else "Brain", "content": m.content} for m in messages]
+
+
+def fetch_prompt_history(chat_id):
+    """
+    Returns (summary, messages) for a chat's prompt: the rolling summary of older turns (or None) and,
+    oldest first, the messages not folded into it yet, at most the last CHAT_HISTORY_TURNS turns.
+    The cap holds even when summarizing falls behind or fails, so the prompt stays within its budget.
+    """
+    chat = Chat.query.get(chat_id) if chat_id is not None else None
+    if chat is None:
+        return None, []
+
+    query = Message.query.filter(Message.chat_id == chat.id)
+    if chat.summarized_through is not None:
+        query = query.filter(Message.id > chat.summarized_through)
+    recent = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(2 * config.CHAT_HISTORY_TURNS).all()
+    return chat.summary, _as_history(reversed(recent))
+
+
+def summarize(summary, messages):
+    """
+    Folds messages into an existing summary (or starts one) with the LLM and returns the new summary.
+    """
+    transcript = "\n".join(f"{m['sender']}: {m['content']}" for m in messages)
+    prompt = (
+        "You maintain a running summary of a conversation between an employee (User) and an assistant (Brain).\n"
+        "Update the summary with the new messages. Keep the facts, names, numbers, decisions and open questions "
+        "a follow-up question could refer to; drop pleasantries. Answer with the summary only, under 250 words.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}\n"
+    )
+    return llm_gateway.generate(prompt, model=config.CHAT_SUMMARY_MODEL).strip()
+
+
+def refresh_summary(chat_id):
+    """
+    Folds the turns older than the last CHAT_HISTORY_TURNS into the chat's summary once they exceed
+    CHAT_SUMMARY_TRIGGER_TOKENS. Returns True if the summary was updated.
+    """
+    chat = Chat.query.get(chat_id)
+    if chat is None:
+        return False
+
+    messages = _unsummarized_messages(chat)
+    pending = messages[:max(0, len(messages) - 2 * config.CHAT_HISTORY_TURNS)]
+    if not pending or estimate_tokens("\n".join(m.content for m in pending)) < config.CHAT_SUMMARY_TRIGGER_TOKENS:
+        return False
+
+    previous = chat.summarized_through
+    summary = summarize(chat.summary, _as_history(pending))
+
+    # Another worker may have refreshed the same chat meanwhile; only the first one wins
+    through = Chat.summarized_through.is_(None) if previous is None else Chat.summarized_through == previous
+    updated = Chat.query.filter(Chat.id == chat_id, through).update(
+        {"summary": summary, "summarized_through": max(m.id for m in pending)}, synchronize_session=False
+    )
+    db.session.commit()
+    if updated:
+        metrics.increment("chat_summary.refreshes")
+        logger.info(f"Summarized {len(pending)} messages of chat {chat_id}")
+    return bool(updated)
+
+
+def schedule_summary_refresh(chat_id):
+    """
+    Refreshes a chat's summary in a background thread, off the request path. Returns True if one was started.
+    """
+    if chat_id is None:
+        return False
+    with _refreshing_lock:
+        if chat_id in _refreshing:
+            return False
+        _refreshing.add(chat_id)
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_refresh_in_background, args=(app, chat_id), name=f"chat-summary-{chat_id}", daemon=True).start()
+    return True
+
+
+def _refresh_in_background(app, chat_id):
+    try:
+        with app.app_context():
+            refresh_summary(chat_id)
+    except Exception as e:
+        metrics.increment("chat_summary.failures")
+        logger.error(f"Failed to refresh the summary of chat {chat_id}: {e}", exc_info=True)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(chat_id)
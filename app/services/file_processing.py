@@ -38,40 +38,70 @@ import subprocess
 import tempfile
 
 
-def extract_text_from_pdf(pdf_path):
+def extract_sections_from_pdf(pdf_path):
+    """Extract text per page as a list of (label, text) sections."""
     with open(pdf_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-    return text
+        return [(f"Page {number}", page.extract_text() or "") for number, page in enumerate(reader.pages, start=1)]
 
 
-def extract_text_from_word(docx_path):
+def extract_text_from_pdf(pdf_path):
+    return "".join(text for _, text in extract_sections_from_pdf(pdf_path))
+
+
+def extract_sections_from_word(docx_path):
+    """Extract text grouped under the nearest preceding heading as (label, text) sections."""
     doc = DocxDocument(docx_path)
-    text = ""
+    sections = []
+    label, text = None, ""
     for paragraph in doc.paragraphs:
+        style_name = paragraph.style.name if paragraph.style is not None else ""
+        if style_name.startswith('Heading') and paragraph.text.strip():
+            if text:
+                sections.append((label, text))
+            label, text = paragraph.text.strip()[:255], ""
         text += paragraph.text + '\n'
-    return text
+    if text:
+        sections.append((label, text))
+    return sections
 
 
-def extract_text_from_ppt(pptx_path):
+def extract_text_from_word(docx_path):
+    return "".join(text for _, text in extract_sections_from_word(docx_path))
+
+
+def extract_sections_from_ppt(pptx_path):
+    """Extract text per slide as a list of (label, text) sections."""
     presentation = Presentation(pptx_path)
-    text = ""
-    for slide in presentation.slides:
+    sections = []
+    for number, slide in enumerate(presentation.slides, start=1):
+        text = ""
         for shape in slide.shapes:
             if hasattr(shape, 'text'):
                 text += shape.text + '\n'
-    return text
+        sections.append((f"Slide {number}", text))
+    return sections
 
-def extract_text_from_excel(excel_path):
+
+def extract_text_from_ppt(pptx_path):
+    return "".join(text for _, text in extract_sections_from_ppt(pptx_path))
+
+
+def extract_sections_from_excel(excel_path):
+    """Extract text per worksheet as a list of (label, text) sections."""
     wb = openpyxl.load_workbook(excel_path, data_only=True)
-    text = ""
+    sections = []
     for sheet in wb.worksheets:
+        text = ""
         for row in sheet.iter_rows(values_only=True):
             row_text = " ".join([str(cell) for cell in row if cell is not None])
             text += row_text + "\n"
-    return text
+        sections.append((f"Sheet {sheet.title}", text))
+    return sections
+
+
+def extract_text_from_excel(excel_path):
+    return "".join(text for _, text in extract_sections_from_excel(excel_path))
 
 
 def generate_docx_from_text(text):
@@ -1,69 +1,195 @@
-from app.utils.ai_helper_methods import get_prompt, search_documents, fetch_document_content
-import google.generativeai as gemini
+from app.utils.ai_helper_methods import get_prompt, search_documents, fetch_document_content, generate_embedding, has_personal_documents
+from app.utils.answer_cache import prepare_query, lookup_answer, store_answer
+from app.utils.context_packing import estimate_tokens
+from app.utils import metrics, llm_gateway
 from app.utils.config import config
 from app.utils.logger import logger
 from app.models.message import Message
 from datetime import datetime
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import time
 from app.models.database import db
 from app.services.user_service import fetch_user_profile
-from app.services.chat_service import get_or_create_default_chat, generate_chat_name, get_chat, fetch_chat_messages
+from app.services.chat_service import get_or_create_default_chat, generate_chat_name, get_chat
+from app.services.chat_summary_service import fetch_prompt_history, schedule_summary_refresh
 
 
-gemini.configure(api_key=config.GEMINI_API_SECRET_KEY)
+# What the preparation phase produced: the cached answer, or the prompt to generate one from
+PreparedAnswer = namedtuple("PreparedAnswer", ["prompt", "answer", "cache_lookup"])
 
+# Runs the independent preparation steps of a message concurrently
+_preparation_pool = ThreadPoolExecutor(max_workers=config.PREPARATION_WORKERS, thread_name_prefix="prepare")
 
-def send_message_receive_response(user_query, current_user, user_id, chat_id, session_id, user_department, is_update=False):
+
+def _prepare_step(app, name, func, *args):
+    # Every step runs in its own app context, and so with its own DB session
+    with app.app_context():
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            metrics.observe(f"prepare.{name}", time.perf_counter() - start)
+
+
+def prepare_answer(user_query, current_user, user_id, chat_id, user_department, is_update=False):
     """
-    Processes the user's query and fetches the chat history, appending context to the AI prompt.
+    Runs everything that comes before answer generation: chat history, user profile, answer cache
+    lookup and document search. The steps are independent, so they run concurrently on the preparation
+    pool and the slowest one sets the latency. Returns a PreparedAnswer.
     """
+    app = current_app._get_current_object()
+    start = time.perf_counter()
+
+    def submit(name, func, *args):
+        return _preparation_pool.submit(_prepare_step, app, name, func, *args)
+
     try:
+        history = submit("history", fetch_prompt_history, chat_id)
         if current_user:
-            user_profile = fetch_user_profile(user_id)
-            user_role = user_profile.get("job_role")
-            
-            search_results = search_documents(user_query, user_id, user_department)
+            profile = submit("profile", fetch_user_profile, user_id)
+            use_answer_cache = config.ANSWER_CACHE_ENABLED and not is_update
+            embed = None
+            if use_answer_cache:
+                # The search and the cache lookup need the same question vector, so it is encoded once for both.
+                # It is queued before them, so it has started by the time either waits for it
+                question_vector = submit("embedding", generate_embedding, user_query)
+                embed = lambda _: question_vector.result()
+            search = submit("search", search_documents, user_query, user_id, user_department, embed)
+            if use_answer_cache:
+                personal_documents = submit("personal_documents", has_personal_documents, user_id)
+                cache_query = submit("answer_cache", prepare_query, user_query, user_department, embed)
+
+        # Older turns are folded into a rolling summary; only the recent ones are sent verbatim
+        history_summary, chat_history = history.result()
+
+        cache_lookup = None
+        if current_user:
+            user_role = profile.result().get("job_role")
+
+            # Only standalone questions are shared between users of a department and role: a follow-up depends
+            # on its chat, a regenerated answer must be new, and personal documents must not leak into colleagues' answers
+            if use_answer_cache and not chat_history and not history_summary and not personal_documents.result():
+                cache_lookup = lookup_answer(cache_query.result(), user_query, user_role)
+                if cache_lookup is not None and cache_lookup.answer is not None:
+                    search.cancel()
+                    return PreparedAnswer(None, cache_lookup.answer, cache_lookup)
+
+            search_results = search.result()
             logger.debug(f"Search results: {search_results}")
 
             document_context = search_results["content"]
         else:
             document_context = "Sorry, you have to be an authenticated user to access this data."
+    finally:
+        metrics.observe("prepare.total", time.perf_counter() - start)
+
+    # Generate prompt with chat history
+    prompt = get_prompt(document_context, user_query, user_role, chat_history, history_summary)
+    prompt_tokens = estimate_tokens(prompt)
+    metrics.record_value("prompt.tokens", prompt_tokens)
+    logger.info(f"Prompt for chat {chat_id}: ~{prompt_tokens} tokens")
+    return PreparedAnswer(prompt, None, cache_lookup)
 
-        # Use the updated fetch_chat_messages method
-        chat_history_result = fetch_chat_messages(chat_id)
-        if chat_history_result["status"] == 200:
-            chat_history = chat_history_result["messages"]
-        else:
-            chat_history = []
 
-        # Generate prompt with chat history
-        prompt = get_prompt(document_context, user_query, user_role, chat_history)
+def generate_answer(prompt, user_id=None):
+    """
+    Sends a prepared prompt to the model and returns the answer text, hedged against slow responses with LLM_HEDGING.
+    """
+    if config.LLM_HEDGING:
+        return llm_gateway.generate_hedged(prompt, user_id=user_id)
+    return llm_gateway.generate(prompt, user_id=user_id)
+
+
+def stream_answer(prompt, user_id=None):
+    """
+    Sends a prepared prompt to the model in streaming mode and yields the answer text piece by piece.
+    """
+    return llm_gateway.stream(prompt, user_id=user_id)
+
 
-        model = gemini.GenerativeModel("gemini-2.0-flash-001")
-        chat_response = model.start_chat(history=[
-            {"role": "user", "parts": prompt}
-            
-        ])
+def save_exchange(user_id, session_id, chat_id, user_query, answer_text):
+    """
+    Saves a question and its answer to the chat and schedules a refresh of the chat summary.
+    Returns (saved_user_message, saved_ai_message, chat_info).
+    """
+    saved_user_message = save_message(user_id, session_id, "User", user_query, chat_id)
+    saved_ai_message = save_message(user_id, session_id, "Brain", answer_text, chat_id)
+
+    schedule_summary_refresh(saved_ai_message["chat_id"])
+
+    chat = get_chat(chat_id)
+    chat_info = chat.to_dict() if chat and hasattr(chat, "to_dict") else {}
+    return saved_user_message, saved_ai_message, chat_info
 
-        answer = chat_response.send_message('text') 
+
+def send_message_receive_response(user_query, current_user, user_id, chat_id, session_id, user_department, is_update=False):
+    """
+    Processes the user's query and fetches the chat history, appending context to the AI prompt.
+    """
+    try:
+        prepared = prepare_answer(user_query, current_user, user_id, chat_id, user_department, is_update)
+        answer_text = prepared.answer
+        if answer_text is None:
+            answer_text = generate_answer(prepared.prompt, user_id)
+            store_answer(prepared.cache_lookup, user_query, answer_text)
         
         if not is_update:
-            saved_user_message = save_message(user_id, session_id, "User", user_query, chat_id)
-            saved_ai_message = save_message(user_id, session_id, "Brain", answer.text, chat_id)
-        
-            chat = get_chat(chat_id)
-            chat_info = chat.to_dict() if chat and hasattr(chat, "to_dict") else {}
+            saved_user_message, saved_ai_message, chat_info = save_exchange(user_id, session_id, chat_id, user_query, answer_text)
         else:
             saved_user_message = None
             saved_ai_message = None
             chat_info = {}
 
-        return {"query": user_query, "answer": answer.text, "saved_user_message": saved_user_message, "saved_ai_message": saved_ai_message, "chat": chat_info}
+        return {"query": user_query, "answer": answer_text, "saved_user_message": saved_user_message, "saved_ai_message": saved_ai_message, "chat": chat_info}
 
     except Exception as e:
         logger.error(f"Error in query_documents: {e}", exc_info=True)
         return {"error": f"Internal server error: {str(e)}"}
 
 
+def stream_message_response(user_query, current_user, user_id, chat_id, session_id, user_department):
+    """
+    Streaming variant of send_message_receive_response. Yields ("token", text) events as the answer is
+    generated, then one ("done", result) or ("error", result) event.
+
+    The exchange is saved once the answer is complete; if the consumer goes away first (the client
+    disconnected), the partial answer is saved instead.
+    """
+    start = time.perf_counter()
+    pieces = []
+    complete = False
+    try:
+        prepared = prepare_answer(user_query, current_user, user_id, chat_id, user_department)
+        if prepared.answer is not None:
+            pieces.append(prepared.answer)
+            metrics.observe("chat.time_to_first_token", time.perf_counter() - start)
+            yield "token", prepared.answer
+        else:
+            for piece in stream_answer(prepared.prompt, user_id):
+                if not pieces:
+                    metrics.observe("chat.time_to_first_token", time.perf_counter() - start)
+                pieces.append(piece)
+                yield "token", piece
+            store_answer(prepared.cache_lookup, user_query, "".join(pieces))
+        complete = True
+
+        saved_user_message, saved_ai_message, chat_info = save_exchange(user_id, session_id, chat_id, user_query, "".join(pieces))
+        yield "done", {"query": user_query, "saved_user_message": saved_user_message, "saved_ai_message": saved_ai_message, "chat": chat_info}
+    except GeneratorExit:
+        if not complete and pieces:
+            metrics.increment("chat.stream_disconnects")
+            logger.info(f"Client disconnected from chat {chat_id} stream; saving the partial answer")
+            try:
+                save_exchange(user_id, session_id, chat_id, user_query, "".join(pieces))
+            except Exception as e:
+                logger.error(f"Failed to save partial answer: {e}", exc_info=True)
+        raise
+    except Exception as e:
+        logger.error(f"Error in stream_message_response: {e}", exc_info=True)
+        yield "error", {"error": f"Internal server error: {str(e)}"}
 
 
 def save_message(user_id, session_id, sender, content, chat_id=None):
@@ -94,4 +220,68 @@ def save_message(user_id, session_id, sender, content, chat_id=None):
     except Exception as e:
         logger.error(f"Error saving query history: {e}", exc_info=True)
         raise
-    
\ No newline at end of file
+    
+
+def update_full_messages(user_message_id, ai_message_id, new_content, current_user, user_id, session_id, user_department):
+    """
+    Replaces the content of a user message, regenerates the AI answer that followed it and keeps the
+    previous versions of both in their edit history. Returns (response, status code).
+    """
+    # Fetch both the user message and the AI message from the database
+    user_message = Message.query.get(user_message_id)
+    ai_message = Message.query.get(ai_message_id)
+
+    if not user_message or not ai_message:
+        return {"error": "User or AI Message not found"}, 404
+
+    try:
+        # ------------------------
+        # Update the User Message
+        # ------------------------
+        user_edits = json.loads(user_message.edits) if user_message.edits else []
+        # Append current version before updating
+        user_edits.append({
+            'content': user_message.content,
+            'timestamp': user_message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        user_message.edits = json.dumps(user_edits)
+        user_message.edit_count += 1
+        user_message.content = new_content
+        user_message.timestamp = datetime.utcnow()
+
+        # ---------------------------------------
+        # Regenerate the AI Response for the edit
+        # ---------------------------------------
+        chat_response = send_message_receive_response(
+            new_content, current_user, user_id, user_message.chat_id, session_id, user_department, is_update=True
+        )
+        if "error" in chat_response:
+            db.session.rollback()
+            return chat_response, 500
+
+        # ------------------------
+        # Update the AI Message
+        # ------------------------
+        ai_edits = json.loads(ai_message.edits) if ai_message.edits else []
+        # Save the current AI response version before updating
+        ai_edits.append({
+            'content': ai_message.content,
+            'timestamp': ai_message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        ai_message.edits = json.dumps(ai_edits)
+        ai_message.edit_count += 1
+        ai_message.content = chat_response["answer"]
+        ai_message.timestamp = datetime.utcnow()
+
+        db.session.commit()
+
+        return {
+            "message": "Messages updated successfully",
+            "updated_user_message": user_message.to_dict(),
+            "updated_ai_message": ai_message.to_dict()
+        }, 200
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to update messages: {e}", exc_info=True)
+        return {"error": "Failed to update messages"}, 500
@@ -1,261 +1,425 @@
 from .config import config
-import os
-import gc
 import numpy as np
-import faiss
 from typing import List, Dict
 from app.models.document import (
     Document, 
     GeneralDocument,
-    HRDocument,
-    ITDocument,
-    ReconciliationDocument,
-    MarketingDocument,
-    TransformationDocument,
-    CommunicationDocument,
-    InternalOperationDocument,
-    LegalDocument,
-    AccountDocument,
-    PortfolioRiskDocument,
-    UnderwriterDocument,
-    BusinessOperationDocument,
-    ClientExperienceDocument,
-    RecoveryDocument,
-    ProductDocument,
-    SalesDocument,
+    DocumentChunk,
+    DEPARTMENT_DOCUMENT_MODELS,
+    DEPARTMENT_BY_TABLE,
 )
 from app.models.database import db
 from app.utils.logger import logger
-from sentence_transformers import SentenceTransformer
+from app.utils.embedding_batcher import embed_text, embed_texts
+from app.utils.chunking import chunk_sections
+from app.utils.vector_store import (
+    store_chunk_embeddings,
+    backfill_missing_embeddings,
+    iter_stored_embeddings,
+    sample_stored_embeddings,
+)
+from app.utils.index_factory import build_index, configure_search_params, requires_training, mmap_read_flags
 import hashlib
-import threading 
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.utils import metrics
 from app.exceptions.faissInitializationError import FaissInitializationError
-from app.utils.redis import get_from_cache, set_in_cache
+from app.utils.vector_index import (
+    PartitionedIndex,
+    GENERAL_SCOPE,
+    UNASSIGNED_SCOPE,
+    accessible_scopes,
+    department_scope,
+    user_scope,
+)
+from app.utils.document_locator import document_key, encode_doc_key, hydrate_documents
+from app.utils.lexical_search import lexical_search
+from app.utils.rank_fusion import reciprocal_rank_fusion
+from app.utils.reranker import rerank
+from app.utils.context_packing import pack_context
+from app.utils.redis import get_vector_from_cache, set_vector_in_cache
+from app.utils.search_cache import search_cache_key, get_cached_search, set_cached_search, bump_corpus_generation
 
 
 
 
-index_lock = threading.Lock()
-index = None 
+vector_index = None
 
+# Runs the lexical retriever next to the vector search
+_retrieval_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
 
+# Scopes with a compaction running in a background thread
+_compacting = set()
+_compacting_lock = threading.Lock()
 
-def get_model():
-    return SentenceTransformer(config.HUGGING_FACE_TRANSFORMER)
 
-from typing import List, Dict
-from sqlalchemy.orm import joinedload
-from sqlalchemy import or_
+def table_scope(document_table, user_id=None):
+    """
+    Returns the access scope (and so the index partition) of a document in the given table.
+    user_id is only used for personal documents.
+    """
+    if document_table == GeneralDocument.__tablename__:
+        return GENERAL_SCOPE
+    if document_table == Document.__tablename__:
+        return user_scope(user_id) if user_id else UNASSIGNED_SCOPE
+    department = DEPARTMENT_BY_TABLE.get(document_table)
+    if department is None:
+        raise ValueError(f"Unknown document table: {document_table}")
+    return department_scope(department)
+
+
+def document_scope(document):
+    """
+    Returns the access scope (and so the index partition) a document's chunks belong to.
+    """
+    return table_scope(document.__tablename__, getattr(document, 'user_id', None))
 
-from app.models.document import (
-    Document, 
-    GeneralDocument,
-    HRDocument,
-    ITDocument,
-    ReconciliationDocument,
-    MarketingDocument,
-    TransformationDocument,
-    CommunicationDocument,
-    InternalOperationDocument,
-    LegalDocument,
-    AccountDocument,
-    PortfolioRiskDocument,
-    UnderwriterDocument,
-    BusinessOperationDocument,
-    ClientExperienceDocument,
-    RecoveryDocument,
-    ProductDocument,
-    SalesDocument,
-)
-from app.models.database import db
-from app.utils.logger import logger
 
-def fetch_document_content(document_ids: List[int], user_id: int, user_department: str) -> Dict[int, str]:
+def build_chunk_rows(document_table, document_id, scope, chunks):
     """
-    Fetches the content of documents by their IDs, considering user-specific, department-specific, and general documents.
+    Creates DocumentChunk rows (without embeddings) for a document's (label, text) chunks.
+    """
+    doc_key = encode_doc_key(document_table, document_id)
+    return [
+        DocumentChunk(
+            document_table=document_table,
+            document_id=document_id,
+            doc_key=doc_key,
+            chunk_index=position,
+            scope=scope,
+            section=label[:255] if label else None,
+            content=text,
+        )
+        for position, (label, text) in enumerate(chunks)
+    ]
+
+
+def chunk_label(chunk, documents):
+    document = documents.get(chunk.doc_key)
+    file_name = document.file_name if document is not None else "Unknown document"
+    return f"{file_name} - {chunk.section}" if chunk.section else file_name
+
+
+def rerank_chunks(query, chunks):
+    """
+    Keeps the RERANK_TOP_K chunks the cross-encoder scores best for the query, or the first SEARCH_TOP_K
+    in retrieval order when re-ranking is disabled or doesn't fit its time budget.
+    """
+    if not config.RERANK_ENABLED or not query:
+        return chunks[:config.SEARCH_TOP_K]
+
+    order = rerank(query, [chunk.content for chunk in chunks], config.RERANK_TOP_K)
+    if order is None:
+        return chunks[:config.SEARCH_TOP_K]
+    return [chunks[position] for position in order]
+
+
+def fetch_document_content(chunk_ids: List[int], user_id: int, user_department: str, query: str = None) -> Dict[int, str]:
+    """
+    Fetches the matched chunks the user may see, keeping the search ranking (re-ranked against query
+    when given), and packs their most relevant passages within CONTEXT_TOKEN_BUDGET.
     """
     try:
-        if not document_ids:
-            logger.warning("Empty document IDs provided.")
+        if not chunk_ids:
+            logger.warning("Empty chunk IDs provided.")
             return {"error": "No documents found"}
 
-        # Fetch user-specific documents
-        user_documents = Document.query.with_entities(Document.content).filter(
-            Document.id.in_(document_ids),
-            Document.user_id == user_id
+        chunks = DocumentChunk.query.filter(
+            DocumentChunk.id.in_(chunk_ids),
+            DocumentChunk.scope.in_(accessible_scopes(user_id, user_department))
         ).all()
 
-        # Fetch department-specific documents based on the user's department
-        department_documents = []
-        if user_department == 'hr':
-            department_documents = HRDocument.query.with_entities(HRDocument.content).filter(
-                HRDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'it':
-            department_documents = ITDocument.query.with_entities(ITDocument.content).filter(
-                ITDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'reconciliation':
-            department_documents = ReconciliationDocument.query.with_entities(ReconciliationDocument.content).filter(
-                ReconciliationDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'marketing':
-            department_documents = MarketingDocument.query.with_entities(MarketingDocument.content).filter(
-                MarketingDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'transformation':
-            department_documents = TransformationDocument.query.with_entities(TransformationDocument.content).filter(
-                TransformationDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'communication':
-            department_documents = CommunicationDocument.query.with_entities(CommunicationDocument.content).filter(
-                CommunicationDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'internal_operations':
-            department_documents = InternalOperationDocument.query.with_entities(InternalOperationDocument.content).filter(
-                InternalOperationDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'legal':
-            department_documents = LegalDocument.query.with_entities(LegalDocument.content).filter(
-                LegalDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'accounts':
-            department_documents = AccountDocument.query.with_entities(AccountDocument.content).filter(
-                AccountDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'portfolio_risk':
-            department_documents = PortfolioRiskDocument.query.with_entities(PortfolioRiskDocument.content).filter(
-                PortfolioRiskDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'underwriting':
-            department_documents = UnderwriterDocument.query.with_entities(UnderwriterDocument.content).filter(
-                UnderwriterDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'business_operations':
-            department_documents = BusinessOperationDocument.query.with_entities(BusinessOperationDocument.content).filter(
-                BusinessOperationDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'client_experience':
-            department_documents = ClientExperienceDocument.query.with_entities(ClientExperienceDocument.content).filter(
-                ClientExperienceDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'recovery':
-            department_documents = RecoveryDocument.query.with_entities(RecoveryDocument.content).filter(
-                RecoveryDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'product':
-            department_documents = ProductDocument.query.with_entities(ProductDocument.content).filter(
-                ProductDocument.id.in_(document_ids)
-            ).all()
-        elif user_department == 'sales':
-            department_documents = SalesDocument.query.with_entities(SalesDocument.content).filter(
-                SalesDocument.id.in_(document_ids)
-            ).all()
-        else:
-            logger.warning(f"Unknown department: {user_department}")
-
-        # Fetch general documents
-        general_documents = GeneralDocument.query.with_entities(GeneralDocument.content).filter(
-            GeneralDocument.id.in_(document_ids)
-        ).all()
+        if not chunks:
+            logger.warning("No accessible chunks found for the given IDs.")
+            return {"error": "No documents found"}
 
-        # Combine all documents
-        all_documents = user_documents + department_documents + general_documents
+        rank = {chunk_id: position for position, chunk_id in enumerate(chunk_ids)}
+        chunks.sort(key=lambda chunk: rank.get(chunk.id, len(rank)))
+        chunks = rerank_chunks(query, chunks)
 
-        if not all_documents:
-            logger.warning("No documents found for the given IDs.")
-            return {"error": "No documents found"}
+        # Resolve the source file names of all matched chunks in one grouped round trip
+        documents = hydrate_documents({chunk.doc_key for chunk in chunks}, columns=("file_name",))
 
-        # Combine document content
-        document_contents = "\n\n".join([doc.content for doc in all_documents])
+        # Pack the most query-relevant passages, labelled with the file and page/slide/sheet they came from,
+        # into the context token budget
+        document_contents, tokens = pack_context(query, [(chunk_label(chunk, documents), chunk.content) for chunk in chunks])
+        metrics.record_value("prompt.context_tokens", tokens)
 
         return {"content": document_contents}
     except Exception as e:
-        logger.error(f"Error fetching document content: {e}")
+        logger.error(f"Error fetching document content: {e}", exc_info=True)
         return {"error": str(e)}
     
 def clear_faiss_index():
-    index.reset()
+    vector_index.reset()
     logger.info("index cleared successfully")
     
 def load_faiss_index():
-    global index
+    """
+    Loads the shared partitions (general and every department); personal partitions are loaded on first use.
+    """
+    global vector_index
     try:
-        with index_lock:
-            if config.FAISS_INDEX_FILE and os.path.exists(config.FAISS_INDEX_FILE):
-                index = faiss.read_index(config.FAISS_INDEX_FILE)
-            
-                logger.info(f"FAISS index loaded from {config.FAISS_INDEX_FILE}")
-            else:
-                index = create_new_index()
-                logger.info("New FAISS index created since no file was found.")
+        if vector_index is None:
+            mmap_flags = mmap_read_flags(config.FAISS_INDEX_TYPE) if config.FAISS_MMAP else None
+            if config.FAISS_MMAP and mmap_flags is None:
+                logger.warning(
+                    f"FAISS_MMAP is on but this FAISS build can't memory-map {config.FAISS_INDEX_TYPE} indexes "
+                    f"(needs an ivf_* type, or IO_FLAG_MMAP_IFC from FAISS 1.11+); loading partitions into memory"
+                )
+            vector_index = PartitionedIndex(
+                config.FAISS_INDEX_FILE,
+                create_new_index,
+                flush_interval=config.FAISS_FLUSH_INTERVAL,
+                flush_every=config.FAISS_FLUSH_EVERY,
+                membership_loader=load_partition_membership,
+                configure_index=configure_search_params,
+                mmap=mmap_flags is not None,
+                reload_interval=config.FAISS_RELOAD_INTERVAL,
+                mmap_flags=mmap_flags,
+            )
+        vector_index.load([GENERAL_SCOPE] + [department_scope(department) for department in DEPARTMENT_DOCUMENT_MODELS])
+        logger.info(f"FAISS partitions loaded: {vector_index.counts()}")
     except Exception as e:
         logger.error(f"Failed to initialize FAISS index: {e}")
         raise FaissInitializationError("FAISS index initialization failed") from e
     
 
-def create_new_index():
-    global index
-    index = faiss.IndexHNSWFlat(384, 32) 
-    return faiss.IndexIDMap(index)
+def create_new_index(training_vectors=None):
+    """
+    Creates an empty index of the configured FAISS_INDEX_TYPE, trained on training_vectors when the type needs it.
+    """
+    return build_index(training_vectors=training_vectors)
 
 def generate_embedding(document):
     try:
         doc_hash = hash_query(document)
      
-        cached_embedding = get_from_cache(doc_hash)
+        cached_embedding = get_vector_from_cache(doc_hash)
         if cached_embedding:
             logger.info("Embedding retrieved from cache.")
             return cached_embedding
         
-        model = get_model()
-        embedding = model.encode(document).tolist()
+        embedding = embed_text(document)
         if not isinstance(embedding, list) or len(embedding) != 384:
             raise ValueError("Invalid embedding format.")
         
         
-        set_in_cache(doc_hash, embedding)
+        set_vector_in_cache(doc_hash, embedding)
         logger.info("Embedding computed and cached.")
         return embedding
     except Exception as e:
         logger.error(f"Error generating embedding: {e}", exc_info=True)
         raise
 
-def add_doc_with_id_to_faiss(document, doc_id):
+def index_document(document, sections=None):
     """
-    Adds a document to the FAISS index
+    Splits a document into chunks, stores them and adds one vector per chunk to the FAISS index.
+    sections is an optional list of (label, text) pairs (pages, slides, sheets); the whole content is used otherwise.
     """
     try:
-        embedding = generate_embedding(document)
-        
-        global index
-        if index is None:
+        if vector_index is None:
             raise RuntimeError("FAISS index not initialized")
-        
-        
-        # Create numpy arrays for the document embedding and doc ids
-        embeddings = np.array([embedding]).astype('float32')
-        ids = np.array([doc_id], dtype='int64')
-        
-        index.add_with_ids(embeddings, ids)
 
-        # Save the FAISS index to a file
-        faiss.write_index(index, config.FAISS_INDEX_FILE)
+        if not sections:
+            sections = [(None, document.content)]
+
+        chunks = chunk_sections(sections)
+        if not chunks:
+            logger.warning(f"Document {document.__tablename__}:{document.id} has no text to index.")
+            return []
+
+        embeddings = np.array(embed_texts([text for _, text in chunks])).astype('float32')
+        scope = document_scope(document)
+
+        chunk_rows = build_chunk_rows(document.__tablename__, document.id, scope, chunks)
+        store_chunk_embeddings(chunk_rows, embeddings)
+        db.session.add_all(chunk_rows)
+        db.session.commit()
+
+        ids = np.array([chunk.id for chunk in chunk_rows], dtype='int64')
+        doc_keys = np.array([chunk.doc_key for chunk in chunk_rows], dtype='int64')
+
+        # The partition logs the add; its file is written behind on a timer or after FAISS_FLUSH_EVERY vectors
+        vector_index.add(scope, ids, embeddings, doc_keys)
+        bump_corpus_generation(scope)
+
+        logger.info(f"Indexed {len(chunk_rows)} chunks for document {document.__tablename__}:{document.id}")
+        return ids.tolist()
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error adding document to FAISS index: {e}", exc_info=True)
         raise
-    finally:
-        del embedding
-        gc.collect()
 
 
-    
-def index_contains_document(doc_id):
-    global index
-    if index is None:
+def rebuild_faiss_index_from_store(backfill=True):
+    """
+    Rebuilds every partition from the vectors stored in Postgres, only encoding chunks that have none
+    (unless backfill is False).
+    """
+    encoded = backfill_missing_embeddings() if backfill else 0
+    scopes = [scope for (scope,) in db.session.query(DocumentChunk.scope).distinct()]
+
+    total = 0
+    for scope in scopes:
+        total += rebuild_partition(scope)
+
+    # Partitions with no chunks left are emptied
+    for scope, partition in list(vector_index.partitions.items()):
+        if scope not in scopes and partition.ntotal:
+            vector_index.replace(scope, create_new_index(), np.empty(0, dtype='int64'), np.empty(0, dtype='int64'))
+    bump_corpus_generation(*scopes, *vector_index.partitions)
+
+    logger.info(f"FAISS index rebuilt from {total} stored vectors in {len(scopes)} partitions ({encoded} newly encoded)")
+    return total
+
+
+def rebuild_partition(scope):
+    """
+    Builds a fresh index for one scope from its stored vectors and swaps it in, dropping tombstoned vectors.
+    Searches keep using the old index until the swap; adds made meanwhile are carried over.
+    Returns the number of vectors in the new index.
+    """
+    partition = vector_index.get(scope)
+    partition.begin_rebuild()
+
+    scope_query = DocumentChunk.query.filter_by(scope=scope)
+    training_vectors = None
+    if requires_training(config.FAISS_INDEX_TYPE.lower()):
+        training_vectors = sample_stored_embeddings(config.FAISS_TRAIN_SAMPLE, query=scope_query)
+    new_index = create_new_index(training_vectors)
+    scope_ids, scope_doc_keys = [], []
+    for ids, vectors, doc_keys in iter_stored_embeddings(query=scope_query):
+        new_index.add_with_ids(vectors, ids)
+        scope_ids.append(ids)
+        scope_doc_keys.append(doc_keys)
+
+    vector_index.replace(
+        scope,
+        new_index,
+        np.concatenate(scope_ids) if scope_ids else np.empty(0, dtype='int64'),
+        np.concatenate(scope_doc_keys) if scope_doc_keys else np.empty(0, dtype='int64'),
+    )
+    return sum(len(ids) for ids in scope_ids)
+
+
+def schedule_compaction(scope):
+    """
+    Starts a background rebuild of a partition once its tombstone ratio reaches FAISS_COMPACTION_THRESHOLD.
+    Returns True if a compaction was started.
+    """
+    partition = vector_index.partitions.get(scope)
+    if partition is None or partition.tombstone_ratio < config.FAISS_COMPACTION_THRESHOLD:
         return False
-    with index_lock:
-        return np.any(index.id_map == doc_id)
+    with _compacting_lock:
+        if scope in _compacting:
+            return False
+        _compacting.add(scope)
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_compact_partition, args=(app, scope), name=f"faiss-compact-{scope}", daemon=True).start()
+    return True
+
+
+def _compact_partition(app, scope):
+    try:
+        with app.app_context():
+            tombstones = len(vector_index.partitions[scope].tombstones)
+            total = rebuild_partition(scope)
+            metrics.increment("faiss.compactions")
+            logger.info(f"FAISS partition {scope} compacted: {tombstones} tombstones dropped, {total} vectors kept")
+    except Exception as e:
+        logger.error(f"Failed to compact FAISS partition {scope}: {e}", exc_info=True)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(scope)
+
+
+def _drop_document_chunks(document):
+    """
+    Deletes a document's chunk rows (without committing) and returns their ids.
+    """
+    doc_key = document_key(document)
+    chunk_ids = [chunk_id for (chunk_id,) in db.session.query(DocumentChunk.id).filter(DocumentChunk.doc_key == doc_key)]
+    DocumentChunk.query.filter(DocumentChunk.doc_key == doc_key).delete(synchronize_session=False)
+    return chunk_ids
+
+
+def _tombstone_chunks(scope, chunk_ids):
+    removed = vector_index.remove(scope, chunk_ids)
+    if removed:
+        schedule_compaction(scope)
+    return removed
+
+
+def delete_document(document):
+    """
+    Deletes a document with its chunks and removes its vectors from search.
+    """
+    try:
+        scope = document_scope(document)
+        chunk_ids = _drop_document_chunks(document)
+        db.session.delete(document)
+        db.session.commit()
+        removed = _tombstone_chunks(scope, chunk_ids)
+        bump_corpus_generation(scope)
+        logger.info(f"Deleted document {document.__tablename__}:{document.id} ({removed} vectors tombstoned)")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error deleting document: {e}", exc_info=True)
+        raise
+
+
+def replace_document(document, content, sections=None, **fields):
+    """
+    Replaces a document's content (and any other given columns) and re-indexes it.
+    Returns the ids of the new chunks.
+    """
+    try:
+        scope = document_scope(document)
+        chunk_ids = _drop_document_chunks(document)
+        document.content = content
+        for name, value in fields.items():
+            setattr(document, name, value)
+        db.session.commit()
+        _tombstone_chunks(scope, chunk_ids)
+        bump_corpus_generation(scope)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error replacing document: {e}", exc_info=True)
+        raise
+    return index_document(document, sections)
+
+
+def load_partition_membership(scope):
+    """
+    Reads the chunk ids and document keys of a scope from the database, for partitions without a saved id file.
+    """
+    rows = db.session.query(DocumentChunk.id, DocumentChunk.doc_key).filter(DocumentChunk.scope == scope).all()
+    return [chunk_id for chunk_id, _ in rows], [doc_key for _, doc_key in rows]
+
+
+def document_is_indexed(document):
+    """
+    Returns True if chunks for the document are already in its index partition.
+    """
+    return vector_index.contains_document(document_key(document), document_scope(document))
+
+
+def documents_missing_from_index(doc_keys, scope):
+    """
+    Returns which of the given document keys have no chunks in the scope's partition.
+    """
+    return vector_index.missing_documents(doc_keys, scope)
+
+
+def has_personal_documents(user_id):
+    """
+    Returns True if the user has uploaded documents of their own.
+    """
+    return db.session.query(DocumentChunk.id).filter(DocumentChunk.scope == user_scope(user_id)).first() is not None
 
 
 def hash_query(query: str) -> str:
@@ -265,38 +429,82 @@ def hash_query(query: str) -> str:
     return hashlib.sha256(query.encode()).hexdigest()
 
 
-def search_documents(query, user_id, user_department):
+def vector_retrieve(query, scopes, k, embed=None):
     """
-    Searches the FAISS index for documents matching the query.
+    Returns the ids of the k chunks nearest to the query in the given partitions, merged by distance.
+    embed(query) returns the query vector (generate_embedding by default).
+    """
+    embedding = np.array([(embed or generate_embedding)(query)]).astype('float32')
+    return [chunk_id for _, chunk_id, _ in vector_index.search(embedding, scopes, k)]
+
+
+def _timed(name, func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe(name, elapsed)
+        logger.info(f"{name} took {elapsed * 1000:.1f}ms")
+
+
+def _lexical_retrieve(app, query, scopes, k):
+    with app.app_context():
+        return _timed("search.lexical", lexical_search, query, scopes, k)
+
+
+def retrieve_chunk_ids(query, scopes, k, embed=None):
+    """
+    Returns up to k ranked chunk ids for a query (more with hybrid search). With HYBRID_SEARCH the vector and
+    lexical (Postgres full-text) retrievers run in parallel and their rankings are fused with reciprocal rank fusion.
+    """
+    if not config.HYBRID_SEARCH:
+        return _timed("search.vector", vector_retrieve, query, scopes, k, embed)
+
+    candidates = max(config.SEARCH_CANDIDATES, k)
+    lexical = _retrieval_pool.submit(_lexical_retrieve, current_app._get_current_object(), query, scopes, candidates)
+    vector_ids = _timed("search.vector", vector_retrieve, query, scopes, candidates, embed)
+    try:
+        lexical_ids = lexical.result()
+    except Exception as e:
+        # Lexical search is an enhancement; fall back to vector order if it fails
+        logger.warning(f"Lexical search failed, using vector results only: {e}")
+        lexical_ids = []
+    return reciprocal_rank_fusion([vector_ids, lexical_ids], k=config.RRF_K, limit=candidates)
+
+
+def search_documents(query, user_id, user_department, embed=None):
+    """
+    Searches the chunks the user can access (vector and lexical retrieval) for documents matching the query.
+    embed(query) returns the query vector, for callers that already have it (generate_embedding by default).
     """
     
     try:
-        global index
-        if index is None:
+        if vector_index is None:
             raise RuntimeError("FAISS index not initialized")
         
-        query_hash = hash_query(query)
-
-        # Check Redis cache for search results
-        cached_result = get_from_cache(query_hash)
+        scopes = accessible_scopes(user_id, user_department)
+        # Users without documents of their own search exactly what their department does, so they share its entries
+        if user_id and not has_personal_documents(user_id):
+            scopes.remove(user_scope(user_id))
+        cache_key = search_cache_key(query, scopes)
+
+        # Cached per access scope and corpus generation, so results never cross scopes or outlive a change
+        cached_result = get_cached_search(cache_key)
         if cached_result:
             logger.info("Search result retrieved from cache.")
             return cached_result
         
-        # Generate query embedding
-        embedding = np.array([generate_embedding(query)]).astype('float32')
-        
-        # Search the index
-        distances, I = index.search(embedding, 10)
-        
-        ids = I.tolist()[0]
-        logger.info(f"Search returned IDs: {ids}")
+        # Over-fetch candidates when a re-ranking stage will pick the best few
+        k = config.RERANK_CANDIDATES if config.RERANK_ENABLED else config.SEARCH_TOP_K
+        ids = retrieve_chunk_ids(query, scopes, k, embed)
+        logger.info(f"Search returned chunk IDs: {ids}")
         
-        # Fetch user-specific or general documents
-        user_documents = fetch_document_content(ids, user_id, user_department)
+        # Fetch the matched chunks of user-specific, department or general documents
+        user_documents = fetch_document_content(ids, user_id, user_department, query)
         
         search_result = {'content': user_documents}
-        set_in_cache(query_hash, search_result)
+        set_cached_search(cache_key, search_result)
         logger.info("Search result cached.")
         
         return search_result
@@ -305,14 +513,17 @@ def search_documents(query, user_id, user_department):
         raise RuntimeError("An error occurred during document search") from e
 
 
-def get_prompt(document_context, user_query, user_role, chat_history):
+def get_prompt(document_context, user_query, user_role, chat_history, history_summary=None):
     """
     Creates a prompt for the AI that incorporates chat history for better contextual understanding.
+    chat_history holds the recent messages verbatim; history_summary summarizes the turns before them.
     """
     history_context = "\n".join([f"{msg['sender']}: {msg['content']}" for msg in chat_history])
+    summary_context = f"Summary of the Earlier Conversation:\n{history_summary}\n\n" if history_summary else ""
 
     prompt = (
         f"Your name is Brain. TCG refers to The Concept Group (Nigeria), specializing in financial services, technology, and business solutions.  Answer the following prompt using your knowledge and the provided context, drawing upon the documents where applicable.\n\n"
+        f"{summary_context}"
         f"Chat History:\n{history_context}\n\n"
         f"Documents:\n{document_context}\n\n"
         f"User Role: {user_role} (Answer in a style appropriate for this professional role.)\n\n"
@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from redis.exceptions import RedisError
+from .config import config
+from app.utils.logger import logger
+from app.utils import metrics
+from app.utils.vector_index import GENERAL_SCOPE, department_scope
+from app.utils.search_cache import corpus_generations
+
+
+# A question ready to be looked up: its department, the corpus generation it is asked against and its normalized vector
+AnswerQuery = namedtuple("AnswerQuery", ["department", "generation", "vector"])
+
+# What a lookup found, and what is needed to store the answer under the same key and generation afterwards
+AnswerLookup = namedtuple("AnswerLookup", ["answer", "similarity", "query", "role"])
+
+
+class _Entry:
+    __slots__ = ("question", "answer", "created_at", "hits")
+
+    def __init__(self, question, answer):
+        self.question = question
+        self.answer = answer
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class _Bucket:
+    """
+    The answers cached for one department and role at one corpus generation, with their normalized question vectors.
+    """
+
+    def __init__(self, generation, dim):
+        self.generation = generation
+        self.entries = []
+        self.vectors = np.empty((0, dim), dtype='float32')
+
+    def append(self, entry, vector):
+        self.entries.append(entry)
+        self.vectors = np.vstack([self.vectors, vector[np.newaxis, :]])
+
+    def drop(self, positions):
+        keep = [position for position in range(len(self.entries)) if position not in positions]
+        self.entries = [self.entries[position] for position in keep]
+        self.vectors = self.vectors[keep]
+
+
+class AnswerCache:
+    """
+    Per-process semantic cache of chat answers.
+
+    Questions are compared by the cosine similarity of their embeddings, within one department, job role
+    (the prompt tailors answers to it) and corpus generation, so an answer is only reused for a near-duplicate
+    question asked by the same kind of user against the same documents.
+    Entries expire after ttl seconds; past max_entries the least frequently hit entry is evicted.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._size = 0
+
+    def _bucket(self, key, generation):
+        # Generations only move forward, so a bucket for any other generation is stale
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket.generation != generation:
+            self._size -= len(bucket.entries)
+            del self._buckets[key]
+            bucket = None
+        return bucket
+
+    def _expire(self, bucket, now):
+        expired = {position for position, entry in enumerate(bucket.entries) if now - entry.created_at > self.ttl}
+        if expired:
+            bucket.drop(expired)
+            self._size -= len(expired)
+            metrics.increment("answer_cache.expired", len(expired))
+
+    def _evict_least_used(self):
+        victim = None
+        for key, bucket in self._buckets.items():
+            for position, entry in enumerate(bucket.entries):
+                rank = (entry.hits, entry.created_at)
+                if victim is None or rank < victim[0]:
+                    victim = (rank, key, position)
+        if victim is not None:
+            _, key, position = victim
+            self._buckets[key].drop({position})
+            self._size -= 1
+            metrics.increment("answer_cache.evictions")
+
+    def get(self, key, generation, vector):
+        """
+        Returns (entry, similarity) for the most similar cached question under key (department, role),
+        or (None, best similarity) below the threshold.
+        """
+        with self._lock:
+            bucket = self._bucket(key, generation)
+            if bucket is None:
+                return None, None
+            self._expire(bucket, time.monotonic())
+            if not bucket.entries:
+                return None, None
+
+            similarities = bucket.vectors @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None, similarity
+            entry = bucket.entries[best]
+            entry.hits += 1
+            return entry, similarity
+
+    def put(self, key, generation, vector, question, answer):
+        with self._lock:
+            bucket = self._bucket(key, generation)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(generation, len(vector))
+            else:
+                self._expire(bucket, time.monotonic())
+            while self._size >= self.max_entries:
+                self._evict_least_used()
+            bucket.append(_Entry(question, answer), vector)
+            self._size += 1
+            metrics.set_gauge("answer_cache.entries", self._size)
+
+
+answer_cache = AnswerCache(config.ANSWER_CACHE_THRESHOLD, config.ANSWER_CACHE_TTL, config.ANSWER_CACHE_MAX_ENTRIES)
+
+
+def _normalized(embedding):
+    vector = np.asarray(embedding, dtype='float32').ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def prepare_query(question, department, embed):
+    """
+    Embeds the question with embed and reads the department's corpus generation: the slow part of a lookup,
+    which can run before the asker's role is known. Returns an AnswerQuery, or None if the corpus generation
+    can't be read.
+    """
+    scopes = [GENERAL_SCOPE] + ([department_scope(department)] if department else [])
+    try:
+        generation = corpus_generations(scopes)
+    except RedisError as e:
+        logger.warning(f"Could not read corpus generations, bypassing the answer cache: {e}")
+        metrics.increment("answer_cache.bypasses")
+        return None
+    return AnswerQuery(department, generation, _normalized(embed(question)))
+
+
+def lookup_answer(query, question, role):
+    """
+    Looks for a cached answer to a near-duplicate question asked in the query's department by a user
+    with the same job role. Returns an AnswerLookup (its answer is None on a miss), or None without a query.
+    """
+    if query is None:
+        return None
+
+    entry, similarity = answer_cache.get((query.department, role), query.generation, query.vector)
+    if entry is None:
+        metrics.increment("answer_cache.misses")
+        if similarity is not None:
+            logger.debug(f"Answer cache miss for department {query.department}, role {role}: best similarity {similarity:.4f}")
+        return AnswerLookup(None, similarity, query, role)
+
+    metrics.increment("answer_cache.hits")
+    logger.info(
+        f"Answer cache hit for department {query.department}, role {role}: similarity {similarity:.4f} "
+        f"(threshold {answer_cache.threshold}), question {question!r} matched {entry.question!r}"
+    )
+    return AnswerLookup(entry.answer, similarity, query, role)
+
+
+def store_answer(lookup, question, answer):
+    """
+    Caches an answer under the role and corpus generation its lookup saw, so an answer generated while
+    the documents changed is never served for the newer generation.
+    """
+    if lookup is None or not answer:
+        return
+    query = lookup.query
+    answer_cache.put((query.department, lookup.role), query.generation, query.vector, question, answer)
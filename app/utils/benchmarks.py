@@ -0,0 +1,109 @@
+import time
+import faiss
+import numpy as np
+from app.utils.cache_codec import encode_vector, decode_vector
+from app.utils.index_factory import build_index, built_index_type, requires_training
+from app.utils.logger import logger
+
+
+def _time_per_call(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def _redis_hit(redis_client, key, payload, decode, iterations):
+    redis_client.set(key, payload, ex=60)
+    try:
+        memory = redis_client.memory_usage(key)
+        latency = _time_per_call(lambda: decode(redis_client.get(key)), iterations)
+    finally:
+        redis_client.delete(key)
+    return latency, memory
+
+
+def benchmark_cache_codec(iterations=1000, dim=384, redis_client=None):
+    """
+    Compares the legacy str()/eval() embedding cache format with the binary codec.
+    Reports payload size and decode latency, plus Redis hit latency and memory when a client is given.
+    """
+    vector = np.random.default_rng(0).standard_normal(dim).astype(np.float32).tolist()
+    formats = {
+        "legacy_str_eval": (str(vector).encode(), lambda data: eval(data)),
+        "float32": (encode_vector(vector, "float32"), decode_vector),
+        "float16": (encode_vector(vector, "float16"), decode_vector),
+    }
+
+    results = {}
+    for name, (payload, decode) in formats.items():
+        result = {
+            "payload_bytes": len(payload),
+            "decode_us": round(_time_per_call(lambda: decode(payload), iterations) * 1e6, 2),
+        }
+        if redis_client is not None:
+            try:
+                latency, memory = _redis_hit(redis_client, f"bench:cache_codec:{name}", payload, decode, iterations)
+                result["redis_hit_us"] = round(latency * 1e6, 2)
+                result["redis_memory_bytes"] = memory
+            except Exception as e:
+                logger.warning(f"Skipping Redis part of cache benchmark: {e}")
+        results[name] = result
+    return results
+
+
+def _recall_at_k(approx_ids, exact_ids, k):
+    hits = sum(len(set(approx[:k].tolist()) & set(exact[:k].tolist()) - {-1}) for approx, exact in zip(approx_ids, exact_ids))
+    return hits / (len(exact_ids) * k)
+
+
+def benchmark_index(vectors, index_types, num_queries=200, k=10, train_sample=50000, seed=0):
+    """
+    Compares FAISS index types on a set of stored embeddings.
+
+    A random held-out subset of the vectors is used as queries; results are compared to exact (IndexFlatL2) search.
+    Reports recall@k, single-query p50/p99 latency, build time and the serialized index size scaled to one million vectors.
+    Rows are labelled with the type actually built, noting the requested one when build_index had to fall back.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    num_queries = min(num_queries, max(1, len(vectors) // 10))
+    order = rng.permutation(len(vectors))
+    queries = vectors[order[:num_queries]]
+    base = vectors[order[num_queries:]]
+    ids = np.arange(len(base), dtype='int64')
+    k = min(k, len(base))
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, exact_ids = exact.search(queries, k)
+
+    results = {}
+    for index_type in index_types:
+        start = time.perf_counter()
+        training_vectors = None
+        if requires_training(index_type):
+            training_vectors = base[rng.choice(len(base), min(train_sample, len(base)), replace=False)]
+        index = build_index(index_type, training_vectors=training_vectors, dim=base.shape[1])
+        index.add_with_ids(base, ids)
+        build_seconds = time.perf_counter() - start
+
+        latencies, approx_ids = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, found = index.search(query.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - start)
+            approx_ids.append(found[0])
+
+        built_type = built_index_type(index)
+        label = built_type if built_type == index_type else f"{built_type} (requested {index_type})"
+
+        index_bytes = faiss.serialize_index(index).nbytes
+        results[label] = {
+            "recall_at_k": round(_recall_at_k(approx_ids, exact_ids, k), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+            "build_s": round(build_seconds, 2),
+            "mb_per_million": round(index_bytes / len(base) * 1_000_000 / (1024 * 1024), 1),
+        }
+    return results
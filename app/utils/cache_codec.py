@@ -0,0 +1,67 @@
+import json
+import struct
+import numpy as np
+
+
+# Bump when the on-wire layout changes; entries written by older versions are then ignored
+CODEC_VERSION = 2
+
+_VECTOR_TAG = b"V"
+_JSON_TAG = b"J"
+_HEADER = struct.Struct(">cBB")
+
+_DTYPES = {
+    "float32": (1, np.dtype("<f4")),
+    "float16": (2, np.dtype("<f2")),
+}
+_DTYPE_CODES = {code: dtype for code, dtype in _DTYPES.values()}
+
+
+def versioned_key(kind, key):
+    """
+    Namespaces a cache key by value kind and codec version.
+    """
+    return f"v{CODEC_VERSION}:{kind}:{key}"
+
+
+def encode_vector(vector, dtype="float32"):
+    """
+    Encodes an embedding as a 3 byte header followed by raw little-endian floats.
+    """
+    if dtype not in _DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {dtype}")
+    code, np_dtype = _DTYPES[dtype]
+    return _HEADER.pack(_VECTOR_TAG, CODEC_VERSION, code) + np.asarray(vector, dtype=np_dtype).tobytes()
+
+
+def decode_vector(data):
+    """
+    Decodes a vector written by encode_vector into a list of floats.
+    Returns None for anything written by another codec version or in another format.
+    """
+    if not data or len(data) < _HEADER.size:
+        return None
+    tag, version, code = _HEADER.unpack_from(data)
+    if tag != _VECTOR_TAG or version != CODEC_VERSION or code not in _DTYPE_CODES:
+        return None
+    return np.frombuffer(data, dtype=_DTYPE_CODES[code], offset=_HEADER.size).astype(np.float32).tolist()
+
+
+def encode_json(value):
+    """
+    Encodes a JSON-serializable value (e.g. search results) compactly with a version header.
+    """
+    body = json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    return _HEADER.pack(_JSON_TAG, CODEC_VERSION, 0) + body
+
+
+def decode_json(data):
+    """
+    Decodes a value written by encode_json, or returns None if it isn't one.
+    """
+    if not data or len(data) < _HEADER.size:
+        return None
+    tag, version, _ = _HEADER.unpack_from(data)
+    if tag != _JSON_TAG or version != CODEC_VERSION:
+        return None
+    return json.loads(data[_HEADER.size:].decode("utf-8"))
@@ -0,0 +1,91 @@
+import re
+from .config import config
+
+
+_paragraph_split = re.compile(r"\n\s*\n|\n")
+
+
+def split_words(text, chunk_size, overlap):
+    """
+    Splits a long text into windows of chunk_size words, each sharing overlap words with the previous one.
+    """
+    words = text.split()
+    step = max(1, chunk_size - overlap)
+    windows = []
+    for start in range(0, len(words), step):
+        windows.append(" ".join(words[start:start + chunk_size]))
+        if start + chunk_size >= len(words):
+            break
+    return windows
+
+
+def chunk_section(text, chunk_size, overlap):
+    """
+    Packs the paragraphs of one section into chunks of at most chunk_size words.
+    Consecutive chunks share the last overlap words so sentences on a boundary keep their context.
+    """
+    chunks = []
+    current = []
+    for paragraph in _paragraph_split.split(text):
+        words = paragraph.split()
+        if not words:
+            continue
+
+        if len(words) > chunk_size:
+            if current:
+                chunks.append(" ".join(current))
+                current = []
+            chunks.extend(split_words(paragraph, chunk_size, overlap))
+            continue
+
+        if len(current) + len(words) > chunk_size:
+            chunks.append(" ".join(current))
+            keep = min(overlap, chunk_size - len(words))
+            current = current[-keep:] if keep > 0 else []
+        current.extend(words)
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def chunk_sections(sections, chunk_size=None, overlap=None):
+    """
+    Turns (label, text) sections into a flat list of (label, chunk_text) chunks.
+    Chunks never cross a section boundary, so every chunk stays within one page, slide or sheet.
+    """
+    chunk_size = chunk_size or config.CHUNK_SIZE
+    overlap = config.CHUNK_OVERLAP if overlap is None else overlap
+    overlap = min(overlap, chunk_size // 2)
+
+    chunks = []
+    for label, text in sections:
+        if not text or not text.strip():
+            continue
+        for chunk_text in chunk_section(text, chunk_size, overlap):
+            chunks.append((label, chunk_text))
+    return chunks
+
+
+def recover_sections(content, section_starts, probe_words=8):
+    """
+    Splits a document's content back into the (label, text) sections it was chunked from, given the
+    (label, first chunk text) of each section in order. Uploaded content is its sections' texts joined
+    in order, so each section starts where its first chunk's words are found.
+    Falls back to a single unlabelled section if a start can't be found.
+    """
+    if not section_starts or all(label is None for label, _ in section_starts):
+        return [(None, content)]
+
+    starts = [0]
+    position = 0
+    for _, first_chunk in section_starts[1:]:
+        words = first_chunk.split()[:probe_words]
+        match = re.compile(r"\s+".join(map(re.escape, words))).search(content, position) if words else None
+        if match is None:
+            return [(None, content)]
+        starts.append(match.start())
+        position = match.end()
+
+    ends = starts[1:] + [len(content)]
+    return [(label, content[start:end]) for (label, _), start, end in zip(section_starts, starts, ends)]
@@ -7,7 +7,68 @@ load_dotenv()
 class Config:
     GEMINI_API_SECRET_KEY = os.getenv("GEMINI_API_SECRET_KEY")
     HUGGING_FACE_TRANSFORMER = os.getenv("HUGGING_FACE_TRANSFORMER")
+    EMBEDDING_MODEL_VERSION = os.getenv("EMBEDDING_MODEL_VERSION")
+    EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "true").lower() == "true"
+    EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "true").lower() == "true"
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    EMBEDDING_BATCH_WAIT_MS = int(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+    EMBEDDING_BATCH_TIMEOUT = float(os.getenv("EMBEDDING_BATCH_TIMEOUT", "30"))
     FAISS_INDEX_FILE = os.getenv("FAISS_INDEX_FILE")
+    FAISS_FLUSH_INTERVAL = int(os.getenv("FAISS_FLUSH_INTERVAL", "30"))
+    FAISS_FLUSH_EVERY = int(os.getenv("FAISS_FLUSH_EVERY", "500"))
+    # Only shares index pages between workers for ivf_* types, or any type with FAISS 1.11+ (see index_factory.mmap_read_flags)
+    FAISS_MMAP = os.getenv("FAISS_MMAP", "false").lower() == "true"
+    FAISS_RELOAD_INTERVAL = float(os.getenv("FAISS_RELOAD_INTERVAL", "2"))
+    FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "hnsw")
+    FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+    FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "40"))
+    FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+    FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "1024"))
+    FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+    FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "48"))
+    FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+    FAISS_TRAIN_SAMPLE = int(os.getenv("FAISS_TRAIN_SAMPLE", "50000"))
+    FAISS_COMPACTION_THRESHOLD = float(os.getenv("FAISS_COMPACTION_THRESHOLD", "0.2"))
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "180"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "40"))
+    SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "8"))
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+    SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "20"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+    RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))
+    RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+    RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "4"))
+    RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "150"))
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+    CONTEXT_PASSAGE_WORDS = int(os.getenv("CONTEXT_PASSAGE_WORDS", "60"))
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+    LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash-001")
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    LLM_MAX_CONCURRENCY_PER_USER = int(os.getenv("LLM_MAX_CONCURRENCY_PER_USER", "2"))
+    LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+    LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", "")
+    LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    LLM_HEDGE_MIN_DELAY_MS = int(os.getenv("LLM_HEDGE_MIN_DELAY_MS", "1000"))
+    LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+    LLM_STUB_LATENCY_MS = int(os.getenv("LLM_STUB_LATENCY_MS", "0"))
+    PREPARATION_WORKERS = int(os.getenv("PREPARATION_WORKERS", "16"))
+    CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", "0"))
+    CHAT_JOB_TTL = int(os.getenv("CHAT_JOB_TTL", "3600"))
+    CHAT_JOB_MAX_ATTEMPTS = int(os.getenv("CHAT_JOB_MAX_ATTEMPTS", "2"))
+    # Each waiting client holds a web worker this long; raise it only with an async (gevent) gunicorn worker class
+    CHAT_JOB_MAX_WAIT = int(os.getenv("CHAT_JOB_MAX_WAIT", "5"))
+    CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "3"))
+    CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "1500"))
+    CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gemini-2.0-flash-001")
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
     # SQLALCHEMY_BINDS = {  
@@ -18,6 +79,8 @@ class Config:
     ALLOWED_EXTENSIONS = {"pdf", "docx", "txt", "pptx"}
     CORS_ORIGINS = os.getenv("CORS_ORIGINS")
     REDIS_URL = os.getenv("REDIS_URL")
+    CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))
+    CACHE_VECTOR_DTYPE = os.getenv("CACHE_VECTOR_DTYPE", "float32")
     SECRET_KEY = os.environ.get("SECRET_KEY")
 
 config = Config()
@@ -0,0 +1,96 @@
+import math
+import re
+from .config import config
+from app.utils.chunking import chunk_section
+from app.utils.rank_fusion import reciprocal_rank_fusion
+from app.utils.search_cache import normalize_query
+
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?;:])\s+|\s*\n+\s*")
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """
+    Estimates the model token count of a text without calling the API: one token per punctuation
+    mark and one per started 4 characters of every word, which errs slightly on the high side.
+    """
+    return sum(
+        (len(piece) + 3) // 4 if piece[0].isalnum() or piece[0] == "_" else 1
+        for piece in _TOKEN_PIECES.findall(text or "")
+    )
+
+
+def split_passages(text, seen, max_words):
+    """
+    Splits a chunk into passages of whole sentences (at most max_words words each), leaving out
+    sentences already in seen, e.g. from the overlap with a neighbouring chunk. Adds the kept ones to seen.
+    """
+    sentences = []
+    for sentence in _SENTENCE_SPLIT.split(text or ""):
+        key = normalize_query(sentence)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        sentences.append(sentence)
+    return chunk_section("\n".join(sentences), max_words, 0)
+
+
+def _term_scores(query, passages):
+    """
+    Scores passages by the query terms they contain, each weighted by its rarity among the passages.
+    """
+    terms = set(normalize_query(query).split())
+    passage_terms = [set(normalize_query(passage).split()) & terms for passage in passages]
+    document_frequency = {term: sum(term in found for found in passage_terms) for term in terms}
+    return [
+        sum(math.log(1 + len(passages) / document_frequency[term]) for term in found)
+        for found in passage_terms
+    ]
+
+
+def pack_context(query, ranked_chunks, budget=None, max_words=None):
+    """
+    Builds the document context of a prompt from (label, text) chunks in retrieval order.
+
+    Chunks are split into sentence passages and duplicate sentences are dropped. Passages are ranked by
+    fusing the retrieval order with how well they match the query terms, then added best first while they
+    fit in budget estimated tokens. Returns (context, estimated tokens); passages keep their document
+    order under their chunk's label.
+    """
+    budget = config.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    max_words = max_words or config.CONTEXT_PASSAGE_WORDS
+
+    seen = set()
+    passages, owners = [], []
+    for position, (_, text) in enumerate(ranked_chunks):
+        for passage in split_passages(text, seen, max_words):
+            passages.append(passage)
+            owners.append(position)
+    if not passages:
+        return "", 0
+
+    scores = _term_scores(query or "", passages)
+    by_term = sorted((index for index in range(len(passages)) if scores[index] > 0), key=lambda index: -scores[index])
+    order = reciprocal_rank_fusion([list(range(len(passages))), by_term], k=config.RRF_K)
+
+    header_tokens = [estimate_tokens(f"[{label}]\n") for label, _ in ranked_chunks]
+    selected = set()
+    used_chunks = set()
+    used = 0
+    for index in order:
+        cost = estimate_tokens(passages[index]) + 1
+        if owners[index] not in used_chunks:
+            cost += header_tokens[owners[index]] + 1
+        if used + cost > budget:
+            continue
+        selected.add(index)
+        used_chunks.add(owners[index])
+        used += cost
+
+    sections = []
+    for position, (label, _) in enumerate(ranked_chunks):
+        kept = [passages[index] for index in range(len(passages)) if owners[index] == position and index in selected]
+        if kept:
+            sections.append(f"[{label}]\n" + "\n".join(kept))
+    return "\n\n".join(sections), used
@@ -0,0 +1,164 @@
+from collections import defaultdict
+from sqlalchemy import select, literal, union_all
+from app.models.database import db
+from app.models.document import (
+    Document,
+    GeneralDocument,
+    HRDocument,
+    ITDocument,
+    ReconciliationDocument,
+    MarketingDocument,
+    TransformationDocument,
+    CommunicationDocument,
+    InternalOperationDocument,
+    LegalDocument,
+    AccountDocument,
+    PortfolioRiskDocument,
+    UnderwriterDocument,
+    BusinessOperationDocument,
+    ClientExperienceDocument,
+    RecoveryDocument,
+    ProductDocument,
+    SalesDocument,
+    DEPARTMENT_DOCUMENT_MODELS,
+)
+
+
+# Stable tag per document table. Never renumber: tags are baked into stored keys.
+TABLE_TAGS = {
+    Document.__tablename__: 1,
+    GeneralDocument.__tablename__: 2,
+    HRDocument.__tablename__: 3,
+    ITDocument.__tablename__: 4,
+    ReconciliationDocument.__tablename__: 5,
+    MarketingDocument.__tablename__: 6,
+    TransformationDocument.__tablename__: 7,
+    CommunicationDocument.__tablename__: 8,
+    InternalOperationDocument.__tablename__: 9,
+    LegalDocument.__tablename__: 10,
+    AccountDocument.__tablename__: 11,
+    PortfolioRiskDocument.__tablename__: 12,
+    UnderwriterDocument.__tablename__: 13,
+    BusinessOperationDocument.__tablename__: 14,
+    ClientExperienceDocument.__tablename__: 15,
+    RecoveryDocument.__tablename__: 16,
+    ProductDocument.__tablename__: 17,
+    SalesDocument.__tablename__: 18,
+}
+TABLES_BY_TAG = {tag: table for table, tag in TABLE_TAGS.items()}
+
+MODELS_BY_TABLE = {model.__tablename__: model for model in [Document, GeneralDocument] + list(DEPARTMENT_DOCUMENT_MODELS.values())}
+
+ROW_ID_BITS = 32
+ROW_ID_MASK = (1 << ROW_ID_BITS) - 1
+
+DEFAULT_COLUMNS = ("file_name", "file_type", "content")
+
+
+def encode_doc_key(document_table, row_id):
+    """
+    Packs a document table and row id into one int64 key that is unique across all document tables.
+    """
+    return (TABLE_TAGS[document_table] << ROW_ID_BITS) | int(row_id)
+
+
+def decode_doc_key(doc_key):
+    """
+    Returns the (document_table, row_id) pair encoded in a document key.
+    """
+    doc_key = int(doc_key)
+    tag = doc_key >> ROW_ID_BITS
+    if tag not in TABLES_BY_TAG:
+        raise ValueError(f"Invalid document key: {doc_key}")
+    return TABLES_BY_TAG[tag], doc_key & ROW_ID_MASK
+
+
+def is_doc_key(value):
+    return int(value) > ROW_ID_MASK
+
+
+def document_key(document):
+    return encode_doc_key(document.__tablename__, document.id)
+
+
+def _select_rows(document_table, condition, columns, priority=0):
+    model = MODELS_BY_TABLE[document_table]
+    return select(
+        literal(TABLE_TAGS[document_table]).label("tag"),
+        literal(priority).label("priority"),
+        model.id.label("id"),
+        *[getattr(model, column).label(column) for column in columns]
+    ).where(condition)
+
+
+def _execute(selects):
+    if not selects:
+        return []
+    statement = selects[0] if len(selects) == 1 else union_all(*selects)
+    return db.session.execute(statement).all()
+
+
+def hydrate_documents(doc_keys, columns=DEFAULT_COLUMNS):
+    """
+    Resolves a batch of document keys to their rows with a single UNION ALL round trip grouped by table.
+    Returns a dict of doc_key -> row (with tag, id and the requested columns).
+    """
+    ids_by_table = defaultdict(list)
+    for doc_key in doc_keys:
+        document_table, row_id = decode_doc_key(doc_key)
+        ids_by_table[document_table].append(row_id)
+
+    selects = [
+        _select_rows(document_table, MODELS_BY_TABLE[document_table].id.in_(row_ids), columns)
+        for document_table, row_ids in ids_by_table.items()
+    ]
+    return {(row.tag << ROW_ID_BITS) | row.id: row for row in _execute(selects)}
+
+
+def _accessible_tables(user_id, user_department, owned_only=False, personal_first=False):
+    # Same precedence as before: general first, then the user's department, then their own documents
+    tables = [(GeneralDocument, GeneralDocument.uploaded_by == user_id if owned_only else None)]
+    department_model = DEPARTMENT_DOCUMENT_MODELS.get(user_department)
+    if department_model is not None:
+        tables.append((department_model, department_model.uploaded_by == user_id if owned_only else None))
+    personal = (Document, Document.user_id == user_id)
+    return [personal] + tables if personal_first else tables + [personal]
+
+
+def locate_document(document_id, user_id, user_department, columns=DEFAULT_COLUMNS, owned_only=False, personal_first=False):
+    """
+    Finds a document the user may access, by document key or by plain row id, in one round trip.
+    A plain id can match a row in several tables: owned_only keeps the documents the user uploaded and
+    personal_first prefers their personal documents, as the edit routes need. Returns the row or None.
+    """
+    only_table = None
+    row_id = int(document_id)
+    if is_doc_key(document_id):
+        try:
+            only_table, row_id = decode_doc_key(document_id)
+        except ValueError:
+            return None
+
+    selects = []
+    tables = _accessible_tables(user_id, user_department, owned_only, personal_first)
+    for priority, (model, owner_condition) in enumerate(tables):
+        if only_table and model.__tablename__ != only_table:
+            continue
+        condition = model.id == row_id
+        if owner_condition is not None:
+            condition = condition & owner_condition
+        selects.append(_select_rows(model.__tablename__, condition, columns, priority))
+
+    rows = _execute(selects)
+    return min(rows, key=lambda row: row.priority) if rows else None
+
+
+def load_located_document(row):
+    """
+    Loads the ORM instance for a row returned by locate_document.
+    """
+    return db.session.get(MODELS_BY_TABLE[TABLES_BY_TAG[row.tag]], row.id)
+
+
+def document_owner_id(document):
+    return document.user_id if isinstance(document, Document) else document.uploaded_by
@@ -0,0 +1,114 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from .config import config
+from app.utils.embedding_model import encode
+from app.utils.logger import logger
+from app.utils import metrics
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text encode requests into batched model.encode calls.
+
+    Texts are queued and flushed by a background thread once max_batch_size texts are waiting
+    or max_wait_ms has passed since the first one arrived, whichever comes first.
+    """
+
+    def __init__(self, max_batch_size=32, max_wait_ms=5):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own flusher
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, text):
+        """
+        Queues a text for encoding and returns a Future resolving to its embedding as a list.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, text, timeout=None):
+        return self.submit(text).result(timeout=timeout)
+
+    def encode_many(self, texts, timeout=None):
+        """
+        Encodes several texts through the shared queue, preserving their order.
+        """
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _, _ in batch]
+            flushed_at = time.perf_counter()
+            for _, _, queued_at in batch:
+                metrics.observe("embedding_batcher.queue_wait", flushed_at - queued_at)
+            metrics.increment("embedding_batcher.batches")
+            metrics.increment("embedding_batcher.texts", len(batch))
+
+            try:
+                embeddings = encode(texts, batch_size=len(texts))
+                for (_, future, _), embedding in zip(batch, embeddings):
+                    future.set_result(embedding.tolist())
+            except Exception as e:
+                logger.error(f"Batched encode of {len(texts)} texts failed: {e}", exc_info=True)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+
+batcher = EmbeddingBatcher(config.EMBEDDING_BATCH_SIZE, config.EMBEDDING_BATCH_WAIT_MS)
+
+
+def embed_text(text):
+    """
+    Returns the embedding of a single text, batched with concurrent callers when batching is enabled.
+    """
+    if not config.EMBEDDING_BATCHING:
+        return encode(text).tolist()
+    return batcher.encode(text, timeout=config.EMBEDDING_BATCH_TIMEOUT)
+
+
+def embed_texts(texts):
+    """
+    Returns embeddings for a list of texts in the same order.
+    """
+    if not texts:
+        return []
+    if not config.EMBEDDING_BATCHING:
+        return [embedding.tolist() for embedding in encode(list(texts), batch_size=config.EMBEDDING_BATCH_SIZE)]
+    return batcher.encode_many(texts, timeout=config.EMBEDDING_BATCH_TIMEOUT)
@@ -0,0 +1,51 @@
+import threading
+import time
+from sentence_transformers import SentenceTransformer
+from .config import config
+from app.utils.logger import logger
+from app.utils import metrics
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """
+    Returns the process-wide SentenceTransformer, loading it on first use.
+    """
+    global _model
+    if _model is not None:
+        return _model
+
+    with _model_lock:
+        if _model is None:
+            start = time.perf_counter()
+            _model = SentenceTransformer(config.HUGGING_FACE_TRANSFORMER)
+            load_time = time.perf_counter() - start
+            metrics.set_gauge("embedding_model.load_seconds", round(load_time, 3))
+            logger.info(f"Embedding model {config.HUGGING_FACE_TRANSFORMER} loaded in {load_time:.2f}s")
+    return _model
+
+
+def encode(texts, **kwargs):
+    """
+    Encodes a string or a list of strings with the shared model and records encode latency.
+    """
+    model = get_model()
+    start = time.perf_counter()
+    embeddings = model.encode(texts, **kwargs)
+    metrics.observe("embedding_model.encode", time.perf_counter() - start)
+    return embeddings
+
+
+def warm_up_model():
+    """
+    Loads the model and runs a throwaway encode so the first real request doesn't pay for it.
+    """
+    try:
+        start = time.perf_counter()
+        encode("warm up")
+        logger.info(f"Embedding model warmed up in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.error(f"Embedding model warm-up failed: {e}", exc_info=True)
@@ -9,7 +9,9 @@ from app.services.file_processing import extract_text_from_pdf, extract_text_fro
 from app.models.document import Document
 from app.utils.logger import logger
 from app.models.database import db
-from app.utils.ai_helper_methods import add_doc_with_id_to_faiss, index_contains_document
+from app.utils.ai_helper_methods import index_document, documents_missing_from_index
+from app.utils.document_locator import document_key, encode_doc_key
+from app.utils.vector_index import UNASSIGNED_SCOPE
 from sqlalchemy.exc import SQLAlchemyError
 
         
@@ -78,6 +80,17 @@ def save_okms_documents(app):
             if okms_response["status"] == 200:
                 documents = okms_response["documents"]
                 
+                # Look up which documents are already stored and indexed in bulk rather than once per document
+                okms_ids = [doc.get("id") for doc in documents if doc.get("id")]
+                existing_ids = {
+                    row.id for row in Document.query.with_entities(Document.id).filter(
+                        Document.id.in_(okms_ids), Document.source == 'okms'
+                    )
+                }
+                unindexed_keys = set(documents_missing_from_index(
+                    [encode_doc_key(Document.__tablename__, okms_id) for okms_id in okms_ids], UNASSIGNED_SCOPE
+                ))
+                
                 for doc in documents:
                     try:
                         document_id = doc.get("id")
@@ -89,9 +102,7 @@ def save_okms_documents(app):
                             logger.warning(f"Skipping invalid document: {doc}")
                             continue
                         
-                        existing_document = Document.query.filter_by(id=document_id, source='okms').first()
-                        
-                        if existing_document:
+                        if document_id in existing_ids:
                             logger.info(f"Document with ID {document_id} already exists. Skipping.")
                             continue
                         
@@ -107,8 +118,8 @@ def save_okms_documents(app):
                         
                         logger.info("Inserted new document", extra={"document_id": document_id, "source": "okms"})
                         
-                        if not index_contains_document(document_id):
-                            add_doc_with_id_to_faiss(new_doc.content, new_doc.id)
+                        if document_key(new_doc) in unindexed_keys:
+                            index_document(new_doc)
                             logger.info(f"Document {document_id} added to FAISS index.")
                             
                     except SQLAlchemyError as db_error:
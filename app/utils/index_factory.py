@@ -0,0 +1,154 @@
+import faiss
+from .config import config
+from app.utils.logger import logger
+
+
+EMBEDDING_DIM = 384
+
+INDEX_TYPES = ("flat", "hnsw", "hnsw_sq8", "sq8", "sq_fp16", "ivf_flat", "ivf_sq8", "ivf_pq")
+TRAINED_INDEX_TYPES = ("hnsw_sq8", "sq8", "ivf_flat", "ivf_sq8", "ivf_pq")
+IVF_INDEX_TYPES = ("ivf_flat", "ivf_sq8", "ivf_pq")
+
+# Set by FAISS builds (1.11+) that can memory-map the code arrays of flat, SQ and HNSW indexes
+MMAP_IFC_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+# FAISS warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def requires_training(index_type):
+    return index_type in TRAINED_INDEX_TYPES
+
+
+def mmap_read_flags(index_type=None):
+    """
+    The faiss.read_index flags that memory-map an index of the given type read-only, or None if this
+    FAISS build can't map it and every worker would read it into private memory.
+
+    What is then shared between workers through the page cache:
+    - ivf_flat, ivf_sq8, ivf_pq: the inverted lists, i.e. all stored vectors (IO_FLAG_MMAP, any build).
+      Partitions still too small to train fall back to hnsw and are read into memory.
+    - flat, sq8, sq_fp16: the stored codes (IO_FLAG_MMAP_IFC, FAISS 1.11+).
+    - hnsw, hnsw_sq8: the stored codes (IO_FLAG_MMAP_IFC, FAISS 1.11+); the graph links stay private.
+    """
+    index_type = (index_type or config.FAISS_INDEX_TYPE).lower()
+    if index_type in IVF_INDEX_TYPES:
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    if MMAP_IFC_FLAG is not None:
+        return MMAP_IFC_FLAG | faiss.IO_FLAG_READ_ONLY
+    return None
+
+
+def _ivf_nlist(num_training_vectors):
+    """
+    The configured number of IVF lists, reduced for small partitions so every list gets enough training points.
+    """
+    return max(1, min(config.FAISS_IVF_NLIST, num_training_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def _build_base_index(index_type, dim, num_training_vectors):
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config.FAISS_HNSW_M)
+        index.hnsw.efConstruction = config.FAISS_HNSW_EF_CONSTRUCTION
+        return index
+    if index_type == "hnsw_sq8":
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, config.FAISS_HNSW_M)
+        index.hnsw.efConstruction = config.FAISS_HNSW_EF_CONSTRUCTION
+        return index
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+    if index_type == "sq_fp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+
+    nlist = _ivf_nlist(num_training_vectors)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    elif index_type == "ivf_sq8":
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit)
+    elif index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, config.FAISS_PQ_M, config.FAISS_PQ_NBITS)
+    else:
+        raise ValueError(f"Unsupported FAISS index type: {index_type}")
+    return index
+
+
+def min_training_size(index_type):
+    if index_type == "ivf_pq":
+        return max(MIN_POINTS_PER_CENTROID, 1 << config.FAISS_PQ_NBITS)
+    if index_type in ("ivf_flat", "ivf_sq8"):
+        return MIN_POINTS_PER_CENTROID
+    return 1
+
+
+def build_index(index_type=None, training_vectors=None, dim=EMBEDDING_DIM):
+    """
+    Builds an empty, id-mapped FAISS index of the configured type (FAISS_INDEX_TYPE).
+
+    Types that need training are trained on training_vectors. Without enough of them (e.g. a new, empty
+    partition) an HNSW index is built instead until `flask rebuild-index` can train the configured type.
+    """
+    index_type = (index_type or config.FAISS_INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported FAISS index type: {index_type}")
+
+    num_training_vectors = 0 if training_vectors is None else len(training_vectors)
+    if requires_training(index_type) and num_training_vectors < min_training_size(index_type):
+        logger.info(f"Not enough vectors to train a {index_type} index ({num_training_vectors}); using hnsw")
+        return build_index("hnsw", dim=dim)
+
+    base_index = _build_base_index(index_type, dim, num_training_vectors)
+    if requires_training(index_type):
+        base_index.train(training_vectors)
+
+    return configure_search_params(faiss.IndexIDMap(base_index))
+
+
+def built_index_type(index):
+    """
+    Returns the INDEX_TYPES name of a built or loaded index, which differs from the requested type when
+    build_index fell back to hnsw for lack of training vectors.
+    """
+    base_index = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+    if isinstance(base_index, faiss.IndexHNSWSQ):
+        return "hnsw_sq8"
+    if isinstance(base_index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base_index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base_index, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sq8"
+    if isinstance(base_index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(base_index, faiss.IndexScalarQuantizer):
+        return "sq_fp16" if base_index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(base_index, faiss.IndexFlat):
+        return "flat"
+    return type(base_index).__name__
+
+
+def configure_search_params(index):
+    """
+    Applies the configured query-time parameters (efSearch, nprobe) to a built or loaded index.
+    """
+    base_index = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+    if hasattr(base_index, 'hnsw'):
+        base_index.hnsw.efSearch = config.FAISS_HNSW_EF_SEARCH
+    if hasattr(base_index, 'nprobe'):
+        base_index.nprobe = config.FAISS_IVF_NPROBE
+    return index
+
+
+def search_parameters(index, selector):
+    """
+    Query-time parameters that restrict a search to the ids accepted by selector, keeping the index's own
+    efSearch or nprobe (each index family needs its own parameter type).
+    """
+    base_index = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+    if hasattr(base_index, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base_index.hnsw.efSearch)
+    if hasattr(base_index, 'nprobe'):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base_index.nprobe)
+    return faiss.SearchParameters(sel=selector)
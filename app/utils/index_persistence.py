@@ -0,0 +1,280 @@
+import atexit
+import fcntl
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+import faiss
+import numpy as np
+from app.utils.logger import logger
+from app.utils import metrics
+
+
+_RECORD_HEADER = struct.Struct("<ii")
+
+# Published generations kept on disk; older ones may still be memory-mapped by workers that haven't reloaded yet
+KEEP_GENERATIONS = 2
+
+
+def write_index_atomically(index, path):
+    """
+    Writes a FAISS index to a temporary file next to path and renames it into place.
+    """
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_text_atomically(text, path):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IndexGenerations:
+    """
+    Immutable, numbered snapshots of one index file and a pointer file naming the current one.
+
+    Generation 0 is the plain index path (what existed before generations); generation N is stored
+    in "<path>.g<N>". Files are never modified once published, so readers can memory-map them safely.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pointer_path = f"{path}.generation"
+
+    def current(self):
+        try:
+            with open(self.pointer_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def file_for(self, generation):
+        return self.path if generation == 0 else f"{self.path}.g{generation}"
+
+    def exists(self, generation):
+        return os.path.exists(self.file_for(generation))
+
+    def publish(self, index, write_sidecars=None):
+        """
+        Writes index (and its sidecar files) as the next generation and points readers at it.
+        Must be called with the writer lock held. Returns the new generation number.
+        """
+        generation = self.current() + 1
+        generation_path = self.file_for(generation)
+        write_index_atomically(index, generation_path)
+        if write_sidecars is not None:
+            write_sidecars(generation_path)
+        write_text_atomically(str(generation), self.pointer_path)
+        self._prune(generation)
+        return generation
+
+    def _prune(self, generation):
+        # Unlinking is safe for workers that still have an old generation mapped; it is freed once they reload
+        oldest_kept = generation - KEEP_GENERATIONS + 1
+        for old in range(max(0, oldest_kept - KEEP_GENERATIONS), oldest_kept):
+            old_path = self.file_for(old)
+            for path in (old_path, f"{old_path}.ids.npy", f"{old_path}.tombstones.npy"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+class IndexPersistenceManager:
+    """
+    Write-behind persistence for a FAISS index.
+
+    Changes are appended to a log next to the index file and a snapshot is only taken
+    every flush_interval seconds, after flush_every pending vectors, or at shutdown.
+    Logged changes that didn't make it into a snapshot are replayed on startup.
+
+    The log is shared by every process serving the index; appends and snapshots are
+    serialized across processes with an exclusive lock on "<path>.lock".
+    """
+
+    def __init__(self, path, snapshot, flush_interval=30, flush_every=500, flush_on_exit=True):
+        self.path = path
+        self.log_path = f"{path}.wal"
+        self.lock_path = f"{path}.lock"
+        self.snapshot = snapshot
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self._state_lock = threading.Lock()
+        self._dirty = False
+        self._pending = 0
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+        if flush_on_exit:
+            atexit.register(self.flush)
+
+    @contextmanager
+    def _file_lock(self, operation):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def exclusive(self):
+        """
+        Holds the cross-process writer lock of the index.
+        """
+        return self._file_lock(fcntl.LOCK_EX)
+
+    def shared(self):
+        """
+        Holds the cross-process lock in shared mode, so the log and generation pointer don't change while read.
+        """
+        return self._file_lock(fcntl.LOCK_SH)
+
+    def _ensure_timer(self):
+        if self.flush_interval <= 0:
+            return
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._state_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="faiss-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Periodic FAISS flush failed: {e}", exc_info=True)
+
+    def mark_dirty(self):
+        with self._state_lock:
+            self._dirty = True
+        self._ensure_timer()
+
+    def _append(self, record):
+        with self.exclusive():
+            with open(self.log_path, 'ab') as log:
+                log.write(record)
+                log.flush()
+                os.fsync(log.fileno())
+
+    def record_add(self, ids, vectors, doc_keys=None):
+        """
+        Logs an add and marks the index dirty. Returns True once flush_every vectors are pending.
+        """
+        ids = np.ascontiguousarray(ids, dtype='<i8')
+        vectors = np.ascontiguousarray(vectors, dtype='<f4')
+        doc_keys = np.full(len(ids), -1, dtype='<i8') if doc_keys is None else np.ascontiguousarray(doc_keys, dtype='<i8')
+        self._append(_RECORD_HEADER.pack(len(ids), vectors.shape[1]) + ids.tobytes() + doc_keys.tobytes() + vectors.tobytes())
+
+        with self._state_lock:
+            self._dirty = True
+            self._pending += len(ids)
+            should_flush = self._pending >= self.flush_every
+        self._ensure_timer()
+        return should_flush
+
+    def record_remove(self, ids):
+        """
+        Logs ids that were tombstoned (a record without vectors) and marks the index dirty.
+        """
+        ids = np.ascontiguousarray(ids, dtype='<i8')
+        self._append(_RECORD_HEADER.pack(len(ids), 0) + ids.tobytes() + np.full(len(ids), -1, dtype='<i8').tobytes())
+        self.mark_dirty()
+
+    def truncate_log(self):
+        """
+        Empties the log once its records are in a published snapshot. Must be called with the writer lock held.
+        """
+        open(self.log_path, 'wb').close()
+
+    def flush(self, force=False):
+        """
+        Takes a snapshot if anything changed since the last one.
+        """
+        with self._state_lock:
+            if not (self._dirty or force):
+                return False
+            self._dirty = False
+            self._pending = 0
+
+        start = time.perf_counter()
+        try:
+            self.snapshot()
+        except Exception:
+            with self._state_lock:
+                self._dirty = True
+            raise
+        metrics.observe("faiss.flush", time.perf_counter() - start)
+        logger.info(f"FAISS index flushed to {self.path}")
+        return True
+
+    def log_size(self):
+        try:
+            return os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            return 0
+
+    def read_log(self, offset=0):
+        """
+        Yields (ids, doc_keys, vectors, end_offset) for every complete record in the log from byte offset on.
+        Removals have zero-width vectors.
+        """
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'rb') as log:
+            log.seek(offset)
+            data = log.read()
+
+        base, offset = offset, 0
+        while offset + _RECORD_HEADER.size <= len(data):
+            count, dim = _RECORD_HEADER.unpack_from(data, offset)
+            body_size = count * 16 + count * dim * 4
+            start = offset + _RECORD_HEADER.size
+            if start + body_size > len(data):
+                logger.warning(f"Ignoring truncated record at the end of {self.log_path}")
+                break
+            ids = np.frombuffer(data, dtype='<i8', count=count, offset=start)
+            doc_keys = np.frombuffer(data, dtype='<i8', count=count, offset=start + count * 8)
+            vectors = np.frombuffer(data, dtype='<f4', count=count * dim, offset=start + count * 16).reshape(count, dim)
+            offset = start + body_size
+            yield ids, doc_keys, vectors, base + offset
+
+    def replay(self, index, known_ids=None, on_replay=None, on_remove=None, offset=0):
+        """
+        Re-applies logged changes (from byte offset on) missing from index.
+        known_ids is any container of ids already in the index; it is not copied.
+        on_replay(ids, doc_keys) is called for every batch that was re-applied and on_remove(ids) for every logged removal.
+        Returns (number of ids replayed, offset after the last complete record).
+        """
+        if known_ids is None:
+            known_ids = set(faiss.vector_to_array(index.id_map).tolist()) if hasattr(index, 'id_map') else set()
+        added = set()
+        replayed = 0
+        end_offset = offset
+        for ids, doc_keys, vectors, end_offset in self.read_log(offset):
+            if vectors.shape[1] == 0:
+                if on_remove is not None:
+                    on_remove(ids)
+                replayed += len(ids)
+                continue
+            missing = np.array([chunk_id not in known_ids and chunk_id not in added for chunk_id in ids.tolist()], dtype=bool)
+            if missing.any():
+                missing_ids = np.ascontiguousarray(ids[missing], dtype='int64')
+                index.add_with_ids(np.ascontiguousarray(vectors[missing], dtype='float32'), missing_ids)
+                added.update(missing_ids.tolist())
+                replayed += int(missing.sum())
+                if on_replay is not None:
+                    on_replay(missing_ids, doc_keys[missing])
+
+        if replayed:
+            logger.info(f"Replayed {replayed} logged changes into the FAISS index")
+        return replayed, end_offset
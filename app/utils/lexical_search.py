@@ -0,0 +1,26 @@
+from sqlalchemy import cast, func, Text
+from sqlalchemy.dialects.postgresql import TSQUERY
+from app.models.database import db
+from app.models.document import DocumentChunk
+
+
+# Must match the text search config of DocumentChunk.search_vector
+LEXICAL_TS_CONFIG = "english"
+
+
+def _any_term_query(query):
+    # plainto_tsquery ANDs every term and a question rarely contains all of them; OR them and let the ranking sort it out
+    return cast(func.replace(cast(func.plainto_tsquery(LEXICAL_TS_CONFIG, query), Text), '&', '|'), TSQUERY)
+
+
+def lexical_search(query, scopes, limit):
+    """
+    Full-text search over the chunks in the given scopes (Postgres tsvector + GIN).
+    Returns up to limit chunk ids, best match first. Exact tokens like account numbers and product codes match as-is.
+    """
+    ts_query = _any_term_query(query)
+    rows = db.session.query(DocumentChunk.id).filter(
+        DocumentChunk.scope.in_(scopes),
+        DocumentChunk.search_vector.op('@@')(ts_query)
+    ).order_by(func.ts_rank_cd(DocumentChunk.search_vector, ts_query).desc()).limit(limit).all()
+    return [chunk_id for (chunk_id,) in rows]
@@ -0,0 +1,494 @@
+import hashlib
+import queue
+import random
+import threading
+import time
+from collections import namedtuple, deque
+from contextlib import contextmanager, closing
+from google.api_core import exceptions as google_exceptions
+from .config import config
+from app.exceptions.llmGatewayError import LLMGatewayError, LLMTimeoutError, LLMBusyError
+from app.utils.context_packing import estimate_tokens
+from app.utils.logger import logger
+from app.utils import metrics
+
+
+# One piece of model output; usage is (prompt_tokens, completion_tokens) when the backend reports it
+Completion = namedtuple("Completion", ["text", "usage"])
+
+# Failures worth another attempt: rate limits, overload and server-side timeouts
+_TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    ConnectionError,
+)
+
+
+class GeminiBackend:
+    """
+    Calls the Gemini API, keeping one GenerativeModel per model name for the life of the process.
+    """
+
+    def __init__(self):
+        import google.generativeai as gemini
+
+        self._gemini = gemini
+        self._gemini.configure(api_key=config.GEMINI_API_SECRET_KEY)
+        self._models = {}
+        self._models_lock = threading.Lock()
+
+    def _model(self, name):
+        model = self._models.get(name)
+        if model is None:
+            with self._models_lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._models[name] = self._gemini.GenerativeModel(name)
+        return model
+
+    @staticmethod
+    def _usage(response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None or not getattr(usage, "prompt_token_count", None):
+            return None
+        return usage.prompt_token_count, usage.candidates_token_count
+
+    def generate(self, prompt, model, timeout):
+        response = self._model(model).generate_content(prompt, request_options={"timeout": timeout})
+        return Completion(response.text, self._usage(response))
+
+    @staticmethod
+    def _cancel(response):
+        # Cancels the underlying streaming RPC (gRPC transport), so a call blocked on its next chunk ends now
+        cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+        if cancel is not None:
+            cancel()
+
+    def stream(self, prompt, model, timeout, cancel=None):
+        response = self._model(model).generate_content(prompt, stream=True, request_options={"timeout": timeout})
+        if cancel is not None:
+            cancel.on_cancel(lambda: self._cancel(response))
+        for chunk in response:
+            text = chunk.text if chunk.parts else ""
+            yield Completion(text, self._usage(chunk))
+
+
+class StubBackend:
+    """
+    Deterministic offline backend for load tests: answers every prompt with a fixed text derived from it,
+    after LLM_STUB_LATENCY_MS, and streams it word by word.
+    """
+
+    def __init__(self, latency_ms=0):
+        self.latency = max(0, latency_ms) / 1000.0
+
+    @staticmethod
+    def answer(prompt):
+        question = prompt.rsplit("Question:", 1)[-1].strip() or "your question"
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return f"[stub {digest}] This is a placeholder answer to: {question}"
+
+    def _usage(self, prompt, text):
+        return estimate_tokens(prompt), estimate_tokens(text)
+
+    def _wait(self, timeout, cancel=None):
+        wait = min(self.latency, max(0, timeout))
+        if cancel is not None and cancel.wait(wait):
+            raise google_exceptions.Cancelled("Stub call cancelled")
+        if cancel is None:
+            time.sleep(wait)
+        if self.latency > timeout:
+            raise google_exceptions.DeadlineExceeded("Stub response exceeded the call timeout")
+
+    def generate(self, prompt, model, timeout):
+        self._wait(timeout)
+        text = self.answer(prompt)
+        return Completion(text, self._usage(prompt, text))
+
+    def stream(self, prompt, model, timeout, cancel=None):
+        self._wait(timeout, cancel)
+        text = self.answer(prompt)
+        words = text.split(" ")
+        for position, word in enumerate(words):
+            if cancel is not None and cancel.is_set():
+                raise google_exceptions.Cancelled("Stub call cancelled")
+            last = position == len(words) - 1
+            yield Completion(word if last else word + " ", self._usage(prompt, text) if last else None)
+
+
+class ConcurrencyLimits:
+    """
+    Caps the model calls in flight, in total and per user, so a burst can't exhaust the API quota
+    or let one user starve the others.
+    """
+
+    def __init__(self, total, per_user):
+        self.per_user = max(1, per_user)
+        self._total = threading.BoundedSemaphore(max(1, total))
+        self._users = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def _user_semaphore(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = [threading.BoundedSemaphore(self.per_user), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _release_user(self, user_id):
+        with self._lock:
+            entry = self._users[user_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._users[user_id]
+
+    def _count(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            metrics.set_gauge("llm.in_flight", self._in_flight)
+
+    @contextmanager
+    def slot(self, user_id, deadline):
+        """
+        Holds a call slot, waiting until deadline (a time.monotonic() value) at most. Raises LLMBusyError.
+        Yields a function that gives the slot back early, e.g. for an abandoned call that may stay blocked.
+        """
+        user_semaphore = self._user_semaphore(user_id) if user_id is not None else None
+        held = []
+        held_lock = threading.Lock()
+
+        def release():
+            with held_lock:
+                while held:
+                    held.pop()()
+
+        try:
+            if user_semaphore is not None:
+                if not user_semaphore.acquire(timeout=max(0, deadline - time.monotonic())):
+                    metrics.increment("llm.rejected_user_limit")
+                    raise LLMBusyError(f"Too many model calls in flight for user {user_id}")
+                held.append(user_semaphore.release)
+            if not self._total.acquire(timeout=max(0, deadline - time.monotonic())):
+                metrics.increment("llm.rejected_global_limit")
+                raise LLMBusyError("Too many model calls in flight")
+            held.append(self._total.release)
+            self._count(1)
+            held.append(lambda: self._count(-1))
+            yield release
+        finally:
+            release()
+            if user_id is not None:
+                self._release_user(user_id)
+
+
+class Cancellation:
+    """
+    Cancels an in-flight streamed call from another thread. set() runs the callbacks registered with
+    on_cancel, which give back the call's slot and close its response where the backend allows it.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Failed to cancel an LLM call: {e}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_limits = ConcurrencyLimits(config.LLM_MAX_CONCURRENCY, config.LLM_MAX_CONCURRENCY_PER_USER)
+
+
+def get_backend():
+    """
+    Returns the process-wide backend selected by LLM_BACKEND ("gemini" or "stub"), creating it on first use.
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+
+    with _backend_lock:
+        if _backend is None:
+            name = config.LLM_BACKEND.lower()
+            if name == "stub":
+                _backend = StubBackend(config.LLM_STUB_LATENCY_MS)
+            elif name == "gemini":
+                _backend = GeminiBackend()
+            else:
+                raise ValueError(f"Unsupported LLM backend: {config.LLM_BACKEND}")
+            logger.info(f"LLM gateway using the {name} backend")
+    return _backend
+
+
+def _account(model, prompt, text, usage, started):
+    prompt_tokens, completion_tokens = usage if usage else (estimate_tokens(prompt), estimate_tokens(text))
+    metrics.increment("llm.calls")
+    metrics.increment("llm.prompt_tokens", prompt_tokens)
+    metrics.increment("llm.completion_tokens", completion_tokens)
+    metrics.record_value("llm.completion_tokens", completion_tokens)
+    metrics.observe("llm.latency", time.monotonic() - started)
+    logger.info(f"LLM call to {model}: {prompt_tokens} prompt + {completion_tokens} completion tokens in {time.monotonic() - started:.2f}s")
+
+
+def _backoff(attempt, deadline, error):
+    """
+    Sleeps before retry number attempt (full jitter, exponential), or re-raises when the deadline doesn't allow one.
+    """
+    if attempt > config.LLM_MAX_RETRIES:
+        raise error
+    delay = random.uniform(0, config.LLM_RETRY_BACKOFF * 2 ** (attempt - 1))
+    if time.monotonic() + delay >= deadline:
+        raise error
+    metrics.increment("llm.retries")
+    logger.warning(f"Retrying LLM call (attempt {attempt + 1}) in {delay:.2f}s after: {error}")
+    time.sleep(delay)
+
+
+def _check_deadline(deadline, model):
+    if time.monotonic() >= deadline:
+        metrics.increment("llm.timeouts")
+        raise LLMTimeoutError(f"LLM call to {model} exceeded its deadline")
+
+
+def generate(prompt, user_id=None, model=None, timeout=None):
+    """
+    Returns the model's answer to prompt. The call (retries included) must finish within timeout seconds
+    (LLM_TIMEOUT); transient failures are retried up to LLM_MAX_RETRIES times.
+    Raises LLMBusyError when no call slot frees up in time and LLMTimeoutError past the deadline.
+    """
+    model = model or config.LLM_MODEL
+    started = time.monotonic()
+    deadline = started + (timeout or config.LLM_TIMEOUT)
+    backend = get_backend()
+
+    with _limits.slot(user_id, deadline):
+        attempt = 0
+        while True:
+            _check_deadline(deadline, model)
+            attempt += 1
+            try:
+                completion = backend.generate(prompt, model, deadline - time.monotonic())
+                break
+            except _TRANSIENT_ERRORS as e:
+                metrics.increment("llm.transient_errors")
+                _backoff(attempt, deadline, e)
+            except Exception:
+                metrics.increment("llm.failures")
+                raise
+
+    _account(model, prompt, completion.text, completion.usage, started)
+    return completion.text
+
+
+def stream(prompt, user_id=None, model=None, timeout=None, slot_wait=None, cancel=None):
+    """
+    Streaming variant of generate: yields the answer text piece by piece. A transient failure is only
+    retried before the first piece; once text was yielded, errors are raised to the caller.
+    slot_wait caps how long to wait for a call slot (the whole deadline by default). Setting cancel
+    (a Cancellation) frees the slot at once and ends the call with an LLMGatewayError.
+    """
+    model = model or config.LLM_MODEL
+    started = time.monotonic()
+    deadline = started + (timeout or config.LLM_TIMEOUT)
+    backend = get_backend()
+
+    slot_deadline = deadline if slot_wait is None else min(deadline, started + slot_wait)
+    with _limits.slot(user_id, slot_deadline) as release_slot:
+        if cancel is not None:
+            cancel.on_cancel(release_slot)
+        attempt = 0
+        pieces = []
+        usage = None
+        while True:
+            _check_deadline(deadline, model)
+            attempt += 1
+            try:
+                for completion in backend.stream(prompt, model, deadline - time.monotonic(), cancel):
+                    usage = completion.usage or usage
+                    if completion.text:
+                        if not pieces:
+                            metrics.observe("llm.time_to_first_token", time.monotonic() - started)
+                        pieces.append(completion.text)
+                        yield completion.text
+                break
+            except Exception as e:
+                if cancel is not None and cancel.is_set():
+                    raise LLMGatewayError(f"LLM stream from {model} was cancelled") from e
+                if not isinstance(e, _TRANSIENT_ERRORS):
+                    metrics.increment("llm.failures")
+                    raise
+                metrics.increment("llm.transient_errors")
+                if pieces:
+                    metrics.increment("llm.failures")
+                    raise LLMGatewayError(f"LLM stream from {model} failed after the first token: {e}") from e
+                _backoff(attempt, deadline, e)
+
+    _account(model, prompt, "".join(pieces), usage, started)
+
+
+class HedgeBudget:
+    """
+    Allows hedge requests for at most max_rate of the calls made in the last window seconds,
+    so hedging can't multiply the spend when the model is slow across the board. At least burst
+    hedges are allowed per window, so a quiet worker can still hedge its occasional slow call.
+    """
+
+    def __init__(self, max_rate, window=60, burst=1):
+        self.max_rate = max_rate
+        self.window = window
+        self.burst = burst
+        self._calls = deque()
+        self._hedges = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for times in (self._calls, self._hedges):
+            while times and now - times[0] > self.window:
+                times.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append(now)
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._hedges) + 1 > max(self.burst, self.max_rate * len(self._calls)):
+                return False
+            self._hedges.append(now)
+            return True
+
+
+_hedge_budget = HedgeBudget(config.LLM_HEDGE_MAX_RATE)
+
+
+class _StreamAttempt(threading.Thread):
+    """
+    Consumes one streamed call in the background and posts (attempt, text, error) to results when it ends.
+    responded is set at the first token (or when the call ends); setting cancelled (a Cancellation)
+    abandons the stream and frees its call slot right away, even if it is stalled waiting for a chunk.
+    """
+
+    def __init__(self, label, prompt, user_id, model, timeout, results, slot_wait=None):
+        super().__init__(name=f"llm-{label}", daemon=True)
+        self.label = label
+        self.prompt = prompt
+        self.user_id = user_id
+        self.model = model
+        self.timeout = timeout
+        self.slot_wait = slot_wait
+        self.results = results
+        self.responded = threading.Event()
+        self.cancelled = Cancellation()
+
+    def run(self):
+        pieces = []
+        try:
+            with closing(stream(self.prompt, self.user_id, self.model, self.timeout, self.slot_wait, self.cancelled)) as pieces_stream:
+                for piece in pieces_stream:
+                    self.responded.set()
+                    if self.cancelled.is_set():
+                        return
+                    pieces.append(piece)
+            self.results.put((self, "".join(pieces), None))
+        except Exception as e:
+            self.results.put((self, None, e))
+        finally:
+            self.responded.set()
+
+
+def hedge_delay():
+    """
+    How long to wait for the first token before hedging: the LLM_HEDGE_PERCENTILE of recent
+    time-to-first-token samples, at least LLM_HEDGE_MIN_DELAY_MS.
+    """
+    observed = metrics.percentile("llm.time_to_first_token", config.LLM_HEDGE_PERCENTILE)
+    return max(config.LLM_HEDGE_MIN_DELAY_MS / 1000.0, observed or 0.0)
+
+
+def generate_hedged(prompt, user_id=None, model=None, hedge_model=None, timeout=None):
+    """
+    generate with a hedge against slow responses: if the call hasn't produced its first token after
+    hedge_delay(), a second call (to hedge_model, LLM_HEDGE_MODEL or the same model) is started and the
+    answer that completes first wins; the other stream is cancelled. Hedges are skipped when the hedge
+    budget (LLM_HEDGE_MAX_RATE) is spent or no call slot is free.
+    """
+    model = model or config.LLM_MODEL
+    hedge_model = hedge_model or config.LLM_HEDGE_MODEL or model
+    timeout = timeout or config.LLM_TIMEOUT
+    deadline = time.monotonic() + timeout
+    _hedge_budget.record_call()
+
+    results = queue.Queue()
+    primary = _StreamAttempt("primary", prompt, user_id, model, timeout, results)
+    primary.start()
+    attempts = [primary]
+
+    hedge = None
+    delay = hedge_delay()
+    if not primary.responded.wait(delay):
+        if _hedge_budget.try_acquire():
+            hedge = _StreamAttempt("hedge", prompt, user_id, hedge_model, deadline - time.monotonic(), results, slot_wait=0)
+            hedge.start()
+            attempts.append(hedge)
+            metrics.increment("llm.hedges")
+            logger.info(f"No first token from {model} after {delay:.2f}s; hedging with {hedge_model}")
+        else:
+            metrics.increment("llm.hedges_skipped_budget")
+
+    error = None
+    for _ in attempts:
+        try:
+            attempt, text, attempt_error = results.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if attempt_error is None:
+            for other in attempts:
+                other.cancelled.set()
+            if hedge is not None:
+                metrics.increment("llm.hedge_wins" if attempt is hedge else "llm.hedge_losses")
+            return text
+        if attempt is hedge and isinstance(attempt_error, LLMBusyError):
+            metrics.increment("llm.hedges_skipped_busy")
+        else:
+            error = attempt_error
+
+    for attempt in attempts:
+        attempt.cancelled.set()
+    if error is not None:
+        raise error
+    metrics.increment("llm.timeouts")
+    raise LLMTimeoutError(f"LLM call to {model} exceeded its deadline")
@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+
+
+_metrics_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_gauges = {}
+_values = {}
+
+# Number of recent samples kept per timing for percentile estimates
+SAMPLE_WINDOW = 1000
+
+
+def increment(name, amount=1):
+    """
+    Increments a named counter.
+    """
+    with _metrics_lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    """
+    Sets a named gauge to the given value.
+    """
+    with _metrics_lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    """
+    Records a duration (in seconds) for a named timing.
+    """
+    with _metrics_lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = {"count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=SAMPLE_WINDOW)}
+            _timings[name] = timing
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+        timing["samples"].append(seconds)
+
+
+def record_value(name, value):
+    """
+    Records a sample of a named quantity that isn't a duration (sizes, token counts).
+    """
+    with _metrics_lock:
+        samples = _values.get(name)
+        if samples is None:
+            samples = {"count": 0, "total": 0, "max": 0, "samples": deque(maxlen=SAMPLE_WINDOW)}
+            _values[name] = samples
+        samples["count"] += 1
+        samples["total"] += value
+        samples["max"] = max(samples["max"], value)
+        samples["samples"].append(value)
+
+
+def percentile(name, pct):
+    """
+    Returns the given percentile (0-100) of the recent samples of a timing, or None if there are none.
+    """
+    with _metrics_lock:
+        timing = _timings.get(name)
+        samples = sorted(timing["samples"]) if timing else []
+    if not samples:
+        return None
+    position = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+    return samples[position]
+
+
+def snapshot():
+    """
+    Returns a plain dictionary view of all counters, gauges and timings.
+    """
+    with _metrics_lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {name: (timing["count"], timing["total"], timing["max"], sorted(timing["samples"])) for name, timing in _timings.items()}
+        values = {name: (value["count"], value["total"], value["max"], sorted(value["samples"])) for name, value in _values.items()}
+
+    timing_summary = {}
+    for name, (count, total, maximum, samples) in timings.items():
+        timing_summary[name] = {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 2) if count else 0.0,
+            "max_ms": round(maximum * 1000, 2),
+            "p50_ms": round(samples[len(samples) // 2] * 1000, 2) if samples else None,
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2) if samples else None,
+        }
+
+    value_summary = {}
+    for name, (count, total, maximum, samples) in values.items():
+        value_summary[name] = {
+            "count": count,
+            "avg": round(total / count, 2) if count else 0.0,
+            "max": maximum,
+            "p50": samples[len(samples) // 2] if samples else None,
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else None,
+        }
+
+    return {"counters": counters, "gauges": gauges, "timings": timing_summary, "values": value_summary}
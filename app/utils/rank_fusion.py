@@ -0,0 +1,11 @@
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """
+    Fuses ranked lists of ids: each id scores sum(1 / (k + rank)) over the lists it appears in (rank starts at 1).
+    Returns the ids ordered by fused score.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    return fused[:limit] if limit else fused
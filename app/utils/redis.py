@@ -1,11 +1,20 @@
 import redis
+from .config import config
+from app.utils.cache_codec import versioned_key, encode_vector, decode_vector, encode_json, decode_json
 
 
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
 
-def get_from_cache(key):
-    value = redis_client.get(key)
-    return None if value is None else eval(value)
+def get_vector_from_cache(key):
+    value = redis_client.get(versioned_key("emb", key))
+    return decode_vector(value)
 
-def set_in_cache(key, value):
-    redis_client.set(key, str(value), ex=3600)
\ No newline at end of file
+def set_vector_in_cache(key, vector):
+    redis_client.set(versioned_key("emb", key), encode_vector(vector, config.CACHE_VECTOR_DTYPE), ex=config.CACHE_TTL)
+
+def get_json_from_cache(key):
+    value = redis_client.get(versioned_key("json", key))
+    return decode_json(value)
+
+def set_json_in_cache(key, value):
+    redis_client.set(versioned_key("json", key), encode_json(value), ex=config.CACHE_TTL)
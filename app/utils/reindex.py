@@ -0,0 +1,255 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sqlalchemy import select, null, func, or_
+from .config import config
+from app.models.database import db
+from app.models.document import DocumentChunk
+from app.utils import ai_helper_methods
+from app.utils.chunking import chunk_sections, recover_sections
+from app.utils.document_locator import TABLE_TAGS, MODELS_BY_TABLE, encode_doc_key
+from app.utils.embedding_model import encode, get_model
+from app.utils.index_persistence import write_text_atomically
+from app.utils.vector_store import store_chunk_embeddings, current_model_version
+from app.utils.logger import logger
+
+
+def _init_embedding_worker():
+    # The pool provides the parallelism, so each process encodes on a single thread
+    import torch
+    torch.set_num_threads(1)
+    get_model()
+
+
+def _encode_batch(texts):
+    return np.asarray(encode(texts, batch_size=config.EMBEDDING_BATCH_SIZE), dtype='float32')
+
+
+class Embedder:
+    """
+    Encodes large batches of texts, split across a pool of worker processes when workers > 1.
+
+    The workers are spawned rather than forked: the parent has usually run the model already (startup
+    warm-up), and forking a process with initialized OpenMP/MKL thread pools can deadlock the children.
+    Each worker loads the model itself.
+    """
+
+    def __init__(self, workers=1, batch_size=256):
+        self.batch_size = max(1, batch_size)
+        self.pool = None
+        if workers > 1:
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_embedding_worker,
+            )
+
+    def encode(self, texts):
+        if self.pool is None:
+            return _encode_batch(texts)
+        parts = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        return np.vstack(list(self.pool.map(_encode_batch, parts)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Progress:
+    """
+    Reports the throughput and ETA of a long-running step at most every interval seconds.
+    """
+
+    def __init__(self, label, total, report=None, interval=5.0):
+        self.label = label
+        self.total = total
+        self.report = report or logger.info
+        self.interval = interval
+        self.done = 0
+        self.start = self._reported_at = time.monotonic()
+
+    def advance(self, count, force=False):
+        self.done += count
+        now = time.monotonic()
+        if not force and now - self._reported_at < self.interval:
+            return
+        self._reported_at = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = f"{max(self.total - self.done, 0) / rate:.0f}s" if rate else "unknown"
+        self.report(f"{self.label}: {self.done}/{self.total} ({rate:.1f}/s, ETA {eta})")
+
+    def finish(self):
+        self.advance(0, force=True)
+
+
+def checkpoint_path():
+    return f"{config.FAISS_INDEX_FILE}.reindex.json"
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    write_text_atomically(json.dumps(checkpoint), path)
+
+
+def _stream_documents(document_table, after_id, page_size):
+    """
+    Streams pages of (id, content, user_id) rows of a document table through a server-side cursor.
+    The cursor has its own connection, so the session can commit between pages.
+    """
+    model = MODELS_BY_TABLE[document_table]
+    owner = model.user_id if hasattr(model, 'user_id') else null()
+    statement = select(model.id, model.content, owner.label("user_id")).where(model.id > after_id).order_by(model.id)
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=page_size).execute(statement)
+        for rows in result.partitions():
+            yield rows
+
+
+def _section_starts(doc_keys):
+    """
+    Returns, per document, the (label, first chunk text) of each run of its chunks sharing a section label.
+    """
+    starts = {}
+    rows = (
+        db.session.query(DocumentChunk.doc_key, DocumentChunk.section, DocumentChunk.content)
+        .filter(DocumentChunk.doc_key.in_(doc_keys))
+        .order_by(DocumentChunk.doc_key, DocumentChunk.chunk_index)
+    )
+    for doc_key, label, text in rows:
+        document_starts = starts.setdefault(doc_key, [])
+        if not document_starts or document_starts[-1][0] != label:
+            document_starts.append((label, text))
+    return starts
+
+
+def chunk_documents(embedder, checkpoint, save, rechunk=False, page_size=200, report=None):
+    """
+    Splits and embeds every document that has no chunks yet (every document with rechunk), table by table.
+    Rechunked documents keep the page, slide and sheet sections of their previous chunks.
+    Commits and checkpoints after each page. Returns the number of chunks created.
+    """
+    tables = list(TABLE_TAGS)
+    if checkpoint.get("table") in tables:
+        tables = tables[tables.index(checkpoint["table"]):]
+
+    after_ids = {table: checkpoint.get("last_id", 0) if table == checkpoint.get("table") else 0 for table in tables}
+    total = sum(
+        db.session.query(func.count(MODELS_BY_TABLE[table].id)).filter(MODELS_BY_TABLE[table].id > after_ids[table]).scalar()
+        for table in tables
+    )
+    progress = Progress("Chunking documents", total, report)
+
+    created = 0
+    for document_table in tables:
+        for rows in _stream_documents(document_table, after_ids[document_table], page_size):
+            rows_by_key = {encode_doc_key(document_table, row.id): row for row in rows}
+            section_starts = {}
+            if rechunk:
+                section_starts = _section_starts(list(rows_by_key))
+                DocumentChunk.query.filter(DocumentChunk.doc_key.in_(list(rows_by_key))).delete(synchronize_session=False)
+                pending = list(rows)
+            else:
+                chunked = {
+                    doc_key for (doc_key,) in
+                    db.session.query(DocumentChunk.doc_key).filter(DocumentChunk.doc_key.in_(list(rows_by_key))).distinct()
+                }
+                pending = [row for doc_key, row in rows_by_key.items() if doc_key not in chunked]
+
+            chunk_rows = []
+            for row in pending:
+                scope = ai_helper_methods.table_scope(document_table, row.user_id)
+                starts = section_starts.get(encode_doc_key(document_table, row.id))
+                chunks = chunk_sections(recover_sections(row.content or "", starts))
+                chunk_rows.extend(ai_helper_methods.build_chunk_rows(document_table, row.id, scope, chunks))
+            if chunk_rows:
+                store_chunk_embeddings(chunk_rows, embedder.encode([chunk.content for chunk in chunk_rows]))
+                db.session.add_all(chunk_rows)
+            db.session.commit()
+
+            created += len(chunk_rows)
+            save(phase="chunk", table=document_table, last_id=rows[-1].id)
+            progress.advance(len(rows))
+    progress.finish()
+    return created
+
+
+def embed_missing_chunks(embedder, checkpoint, save, page_size=2000, report=None):
+    """
+    Encodes chunks without a stored vector for the current model version, in id order.
+    Commits and checkpoints after each page. Returns the number of chunks encoded.
+    """
+    missing = or_(DocumentChunk.embedding.is_(None), DocumentChunk.embedding_model != current_model_version())
+    last_id = checkpoint.get("last_id", 0) if checkpoint.get("phase") == "embed" else 0
+    progress = Progress("Embedding chunks", DocumentChunk.query.filter(missing, DocumentChunk.id > last_id).count(), report)
+
+    encoded = 0
+    while True:
+        chunks = DocumentChunk.query.filter(missing, DocumentChunk.id > last_id).order_by(DocumentChunk.id).limit(page_size).all()
+        if not chunks:
+            break
+        store_chunk_embeddings(chunks, embedder.encode([chunk.content for chunk in chunks]))
+        db.session.commit()
+
+        encoded += len(chunks)
+        last_id = chunks[-1].id
+        save(phase="embed", last_id=last_id)
+        progress.advance(len(chunks))
+    progress.finish()
+    return encoded
+
+
+def reindex_documents(workers=1, batch_size=256, page_size=200, rechunk=False, restart=False, report=None):
+    """
+    Rebuilds the vector index from the document tables:
+
+    1. chunks and embeds documents without chunks (all documents with rechunk),
+    2. embeds chunks without a vector for the current model version,
+    3. builds fresh partition indexes from the stored vectors and publishes them as new generations.
+
+    Progress is checkpointed after every page, so an interrupted run resumes where it stopped
+    unless restart is set. Returns a dict of counts.
+    """
+    path = checkpoint_path()
+    checkpoint = {} if restart else load_checkpoint(path)
+    settings = {"model_version": current_model_version(), "rechunk": rechunk}
+    if checkpoint and any(checkpoint.get(key) != value for key, value in settings.items()):
+        logger.warning(f"Ignoring reindex checkpoint {path}: it was made with different settings")
+        checkpoint = {}
+    if checkpoint:
+        logger.info(f"Resuming reindex from {checkpoint}")
+
+    def save(**state):
+        save_checkpoint(path, {**settings, **state})
+
+    start = time.monotonic()
+    stats = {"chunks_created": 0, "chunks_encoded": 0}
+    phase = checkpoint.get("phase", "chunk")
+    with Embedder(workers, batch_size) as embedder:
+        if phase == "chunk":
+            stats["chunks_created"] = chunk_documents(embedder, checkpoint, save, rechunk, page_size, report)
+            phase = "embed"
+            checkpoint = {}
+        if phase == "embed":
+            stats["chunks_encoded"] = embed_missing_chunks(embedder, checkpoint, save, batch_size * max(1, workers) * 4, report)
+
+    save(phase="build")
+    stats["vectors_indexed"] = ai_helper_methods.rebuild_faiss_index_from_store(backfill=False)
+    os.remove(path)
+    stats["seconds"] = round(time.monotonic() - start, 1)
+    return stats
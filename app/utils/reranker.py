@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from .config import config
+from app.utils.logger import logger
+from app.utils import metrics
+
+
+_model = None
+_model_lock = threading.Lock()
+
+# One scoring call at a time: the model already uses every core, and a call that overran its
+# budget must not make the following requests queue behind it
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+_scoring = threading.Semaphore(1)
+
+# Moving average of the scoring time per (query, passage) pair, used to predict whether a batch fits the budget
+_seconds_per_pair = None
+_SMOOTHING = 0.2
+
+
+def get_reranker():
+    """
+    Returns the process-wide cross-encoder, loading it on first use.
+    """
+    global _model
+    if _model is not None:
+        return _model
+
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import CrossEncoder
+
+            start = time.perf_counter()
+            _model = CrossEncoder(config.RERANK_MODEL, max_length=config.RERANK_MAX_LENGTH)
+            logger.info(f"Re-ranking model {config.RERANK_MODEL} loaded in {time.perf_counter() - start:.2f}s")
+    return _model
+
+
+def _score(query, passages):
+    global _seconds_per_pair
+    try:
+        model = get_reranker()
+        start = time.perf_counter()
+        scores = model.predict([(query, passage) for passage in passages], batch_size=len(passages))
+        elapsed = time.perf_counter() - start
+        per_pair = elapsed / len(passages)
+        _seconds_per_pair = per_pair if _seconds_per_pair is None else (1 - _SMOOTHING) * _seconds_per_pair + _SMOOTHING * per_pair
+        metrics.observe("rerank.score", elapsed)
+        return scores
+    finally:
+        _scoring.release()
+
+
+def rerank(query, passages, top_k, budget_ms=None):
+    """
+    Scores passages against the query with the cross-encoder in one batch and returns the indexes of the
+    top_k best, best first. Returns None (keep the original order) when scoring would not fit in the
+    time budget: the batch is trimmed to what the measured speed allows, and a call that still overruns is abandoned.
+    """
+    if not passages:
+        return []
+    budget = (budget_ms if budget_ms is not None else config.RERANK_BUDGET_MS) / 1000.0
+
+    count = len(passages)
+    if _seconds_per_pair:
+        count = min(count, int(budget / _seconds_per_pair))
+    if count < min(top_k, len(passages)):
+        metrics.increment("rerank.skipped_budget")
+        return None
+
+    if not _scoring.acquire(blocking=False):
+        metrics.increment("rerank.skipped_busy")
+        return None
+
+    future = _executor.submit(_score, query, passages[:count])
+    try:
+        scores = future.result(timeout=budget)
+    except TimeoutError:
+        metrics.increment("rerank.timeouts")
+        logger.warning(f"Re-ranking {count} passages exceeded the {budget * 1000:.0f}ms budget; keeping retrieval order")
+        return None
+    except Exception as e:
+        logger.error(f"Re-ranking failed: {e}", exc_info=True)
+        return None
+
+    order = sorted(range(count), key=lambda position: float(scores[position]), reverse=True)
+    return order[:top_k]
+
+
+def warm_up_reranker():
+    """
+    Loads the cross-encoder and measures its speed so the first budget check has an estimate.
+    """
+    try:
+        if not _scoring.acquire(blocking=False):
+            return
+        _score("warm up", ["warm up"] * 8)
+        logger.info(f"Re-ranking model warmed up ({(_seconds_per_pair or 0) * 1000:.2f}ms per pair)")
+    except Exception as e:
+        logger.error(f"Re-ranking model warm-up failed: {e}", exc_info=True)
@@ -0,0 +1,97 @@
+import hashlib
+import re
+import unicodedata
+from redis.exceptions import RedisError
+from app.utils.logger import logger
+from app.utils import metrics
+from app.utils.redis import redis_client, get_json_from_cache, set_json_in_cache
+
+
+# Characters that don't change what a query matches; "-", "/" and "." are kept inside tokens (e.g. "covid-19", "v2.1")
+_PUNCTUATION = re.compile(r"[^\w\s\-/.]+")
+_TOKEN_EDGES = "-/."
+
+
+def normalize_query(query):
+    """
+    Normalizes a query for cache lookups: Unicode compatibility form, case, punctuation and whitespace.
+    """
+    text = _PUNCTUATION.sub(" ", unicodedata.normalize("NFKC", query or "").lower())
+    return " ".join(token for token in (token.strip(_TOKEN_EDGES) for token in text.split()) if token)
+
+
+def generation_key(scope):
+    return f"corpus_generation:{scope}"
+
+
+def corpus_generations(scopes):
+    """
+    Returns the current (scope, generation) pairs of the given scopes, sorted by scope. Raises RedisError.
+    """
+    scopes = sorted(set(scopes))
+    generations = redis_client.mget([generation_key(scope) for scope in scopes])
+    return tuple((scope, int(generation) if generation else 0) for scope, generation in zip(scopes, generations))
+
+
+def search_cache_key(query, scopes):
+    """
+    Builds the cache key of a search from the normalized query and the current corpus generation of every
+    scope searched, so an upload or delete in any of them makes older entries unreachable.
+    Returns None when the search shouldn't be cached (empty query, or the generations can't be read).
+    """
+    normalized = normalize_query(query)
+    if not normalized:
+        return None
+
+    try:
+        generations = corpus_generations(scopes)
+    except RedisError as e:
+        logger.warning(f"Could not read corpus generations, bypassing the search cache: {e}")
+        return None
+
+    versions = "|".join(f"{scope}={generation}" for scope, generation in generations)
+    return "search:" + hashlib.sha256(f"{versions}\n{normalized}".encode()).hexdigest()
+
+
+def get_cached_search(key):
+    """
+    Returns the cached result for a key from search_cache_key, or None. Counts hits, misses and bypasses.
+    """
+    if key is None:
+        metrics.increment("search_cache.bypasses")
+        return None
+    try:
+        result = get_json_from_cache(key)
+    except RedisError as e:
+        logger.warning(f"Search cache lookup failed: {e}")
+        metrics.increment("search_cache.bypasses")
+        return None
+    metrics.increment("search_cache.hits" if result else "search_cache.misses")
+    return result
+
+
+def set_cached_search(key, result):
+    if key is None:
+        return
+    try:
+        set_json_in_cache(key, result)
+    except RedisError as e:
+        logger.warning(f"Could not cache search result: {e}")
+
+
+def bump_corpus_generation(*scopes):
+    """
+    Moves the given scopes to a new corpus generation, invalidating every cached search that covered them.
+    """
+    scopes = set(scopes)
+    if not scopes:
+        return
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for scope in scopes:
+            pipeline.incr(generation_key(scope))
+        pipeline.execute()
+        metrics.increment("search_cache.invalidations", len(scopes))
+    except RedisError as e:
+        # Entries still expire after CACHE_TTL
+        logger.error(f"Could not bump the corpus generation of {sorted(scopes)}: {e}")
@@ -1,10 +1,10 @@
 import os
 from werkzeug.utils import secure_filename
 from app.services.file_processing import (
-    extract_text_from_pdf, 
-    extract_text_from_word, 
-    extract_text_from_ppt, 
-    extract_text_from_excel
+    extract_sections_from_pdf, 
+    extract_sections_from_word, 
+    extract_sections_from_ppt, 
+    extract_sections_from_excel
 )
 from io import BytesIO
 from .config import config
@@ -36,27 +36,28 @@ def validate_file(file):
 
         # Determine file extension
         file_extension = os.path.splitext(filename)[1][1:].lower()
-        text = ""
+        sections = []
 
         try:
-            # Extract text based on file type
+            # Extract text sections (pages, slides, sheets, headings) based on file type
             if file_extension == 'pdf':
-                text = extract_text_from_pdf(filepath)
+                sections = extract_sections_from_pdf(filepath)
             elif file_extension == 'docx':
-                text = extract_text_from_word(filepath)
+                sections = extract_sections_from_word(filepath)
             elif file_extension == 'pptx':
-                text = extract_text_from_ppt(filepath)
+                sections = extract_sections_from_ppt(filepath)
             elif file_extension in ['xlsx', 'xls']:
-                text = extract_text_from_excel(filepath)
+                sections = extract_sections_from_excel(filepath)
             elif file_extension == 'txt':
                 with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                    text = f.read()
+                    sections = [(None, f.read())]
             else:
                 return {"error": f"Unsupported file type: {file_extension}", "status": 400}
             
-            text = text.encode('utf-8', 'ignore').decode('utf-8')
+            sections = [(label, section_text.encode('utf-8', 'ignore').decode('utf-8')) for label, section_text in sections]
+            text = "".join(section_text for _, section_text in sections)
 
-            return {"file_extension": file_extension, "text": text}
+            return {"file_extension": file_extension, "text": text, "sections": sections}
         except Exception as e:
             # Log or handle specific extraction errors
             return {"error": f"Failed to process file: {str(e)}", "status": 500}
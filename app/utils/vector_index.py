@@ -0,0 +1,642 @@
+import atexit
+import heapq
+import os
+import threading
+import time
+import faiss
+import numpy as np
+from app.utils.index_factory import search_parameters
+from app.utils.index_persistence import IndexPersistenceManager, IndexGenerations
+from app.utils.logger import logger
+from app.utils import metrics
+
+
+GENERAL_SCOPE = "general"
+UNASSIGNED_SCOPE = "unassigned"
+
+
+def department_scope(department):
+    return f"dept:{department}"
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def accessible_scopes(user_id, user_department):
+    """
+    Returns the partitions a user may search: general, their department and their personal documents.
+    """
+    scopes = [GENERAL_SCOPE]
+    if user_department:
+        scopes.append(department_scope(user_department))
+    if user_id:
+        scopes.append(user_scope(user_id))
+    return scopes
+
+
+class IndexMembership:
+    """
+    In-memory map of the chunk ids (and their document keys) held by one partition.
+    Gives constant-time "is this chunk/document indexed" checks without scanning the FAISS id map.
+    """
+
+    def __init__(self, complete=True):
+        self.chunk_docs = {}
+        self.doc_chunk_counts = {}
+        # False when document keys are unknown (no sidecar file) and must be reloaded from the database
+        self.complete = complete
+
+    def add(self, ids, doc_keys):
+        for chunk_id, doc_key in zip(np.asarray(ids).tolist(), np.asarray(doc_keys).tolist()):
+            if chunk_id in self.chunk_docs:
+                continue
+            self.chunk_docs[chunk_id] = doc_key
+            self.doc_chunk_counts[doc_key] = self.doc_chunk_counts.get(doc_key, 0) + 1
+
+    def remove(self, ids):
+        for chunk_id in np.asarray(ids).tolist():
+            if chunk_id not in self.chunk_docs:
+                continue
+            doc_key = self.chunk_docs.pop(chunk_id)
+            remaining = self.doc_chunk_counts[doc_key] - 1
+            if remaining:
+                self.doc_chunk_counts[doc_key] = remaining
+            else:
+                del self.doc_chunk_counts[doc_key]
+
+    def contains_chunk(self, chunk_id):
+        return chunk_id in self.chunk_docs
+
+    def contains_document(self, doc_key):
+        return doc_key in self.doc_chunk_counts
+
+    def missing_documents(self, doc_keys):
+        return [doc_key for doc_key in doc_keys if doc_key not in self.doc_chunk_counts]
+
+    @property
+    def document_count(self):
+        return len(self.doc_chunk_counts)
+
+    def with_doc_keys(self, lookup, force=False):
+        """
+        Returns a copy with document keys taken from lookup (chunk id -> doc key).
+        The copy is only marked complete if every key was found, or if force is set.
+        """
+        membership = IndexMembership(complete=True)
+        chunk_ids = list(self.chunk_docs)
+        doc_keys = [lookup.get(chunk_id, -1) for chunk_id in chunk_ids]
+        membership.add(chunk_ids, doc_keys)
+        membership.complete = force or -1 not in doc_keys
+        return membership
+
+    def save(self, path):
+        # A membership with unknown document keys would be taken as complete on the next load
+        if not self.complete:
+            return
+        pairs = np.array(list(self.chunk_docs.items()), dtype='int64').reshape(-1, 2)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, pairs)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, expected_count):
+        """
+        Loads a saved membership, or returns None if it is missing or doesn't match the index it belongs to.
+        """
+        if not os.path.exists(path):
+            return None
+        pairs = np.load(path)
+        if len(pairs) != expected_count:
+            logger.warning(f"Ignoring {path}: {len(pairs)} ids saved but the index holds {expected_count}")
+            return None
+        membership = cls()
+        membership.add(pairs[:, 0], pairs[:, 1])
+        return membership
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Membership with chunk ids read from the FAISS id map but unknown document keys.
+        """
+        membership = cls(complete=False)
+        if hasattr(index, 'id_map'):
+            ids = faiss.vector_to_array(index.id_map)
+            membership.add(ids, np.full(len(ids), -1, dtype='int64'))
+        return membership
+
+
+def load_tombstones(path):
+    if not path or not os.path.exists(path):
+        return set()
+    return set(np.load(path).tolist())
+
+
+def save_tombstones(tombstones, path):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.array(sorted(tombstones), dtype='int64'))
+    os.replace(tmp_path, path)
+
+
+def tombstone_ids(membership, tombstones, ids):
+    """
+    Moves the indexed ones among ids from membership to tombstones.
+    """
+    ids = [chunk_id for chunk_id in np.asarray(ids).tolist() if membership.contains_chunk(chunk_id)]
+    tombstones.update(ids)
+    membership.remove(ids)
+    return ids
+
+
+class KnownIds:
+    """
+    Membership test over the indexed and tombstoned ids of a partition, without copying them.
+    """
+
+    def __init__(self, membership, tombstones):
+        self.membership = membership
+        self.tombstones = tombstones
+
+    def __contains__(self, chunk_id):
+        return self.membership.contains_chunk(chunk_id) or chunk_id in self.tombstones
+
+
+class IndexPartition:
+    """
+    One FAISS index holding the vectors of a single access scope, with its own lock and write-behind persistence.
+
+    HNSW indexes can't remove vectors, so removed chunk ids are tombstoned: they stay in the index but are
+    filtered out of search results until the partition is compacted (rebuilt from the stored vectors).
+
+    Snapshots are published as immutable generations built from the latest generation plus the shared change
+    log, so concurrent writers never overwrite each other. With mmap the current generation is read with
+    mmap_flags, so the parts FAISS can map (see index_factory.mmap_read_flags) are shared through the page
+    cache by every worker; vectors added since it was published are kept in a small in-memory delta index
+    until the next generation.
+
+    Other workers' changes are picked up by refresh(): a newer generation is swapped in, and changes
+    logged since the current one are replayed, so every worker converges without a restart.
+    """
+
+    def __init__(self, scope, path, index_factory, flush_every=500, configure_index=None, mmap=False, reload_interval=2,
+                 mmap_flags=None):
+        self.scope = scope
+        self.path = path
+        self.index_factory = index_factory
+        self.configure_index = configure_index
+        self.mmap = mmap and bool(path)
+        self.mmap_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap_flags is None else mmap_flags
+        self.lock = threading.Lock()
+        self.index = None
+        self.delta = None
+        self.generation = 0
+        self.reload_interval = reload_interval
+        # Bytes of the shared change log already applied, and when other workers' changes were last checked
+        self._log_offset = 0
+        self._checked_at = 0.0
+        self.membership = IndexMembership()
+        self.tombstones = set()
+        # Adds made while a replacement index is being built, re-applied to it when it is swapped in
+        self._rebuild_adds = None
+        # FAISS selector excluding the tombstones, rebuilt when they change: (tombstone set, size, selectors)
+        self._exclusion = None
+        self.generations = None
+        self.persistence = None
+        if path:
+            self.generations = IndexGenerations(path)
+            self.persistence = IndexPersistenceManager(
+                path, self._publish, flush_interval=0, flush_every=flush_every, flush_on_exit=False
+            )
+
+    def _read_generation(self, generation, mmap=False):
+        """
+        Reads a published generation with its membership and tombstones.
+        """
+        generation_path = self.generations.file_for(generation)
+        if not os.path.exists(generation_path):
+            return self.index_factory(), IndexMembership(), set()
+
+        index = faiss.read_index(generation_path, self.mmap_flags if mmap else 0)
+        if self.configure_index is not None:
+            self.configure_index(index)
+        tombstones = load_tombstones(f"{generation_path}.tombstones.npy")
+        membership = IndexMembership.load(f"{generation_path}.ids.npy", index.ntotal - len(tombstones))
+        if membership is None:
+            membership = IndexMembership.from_index(index)
+            membership.remove(list(tombstones))
+        return index, membership, tombstones
+
+    def _writable_index(self):
+        return self.delta if self.delta is not None else self.index
+
+    def _load_generation(self, generation):
+        """
+        Reads a generation and replays the changes logged since it was published, then serves it.
+        Must be called with the partition lock and the shared file lock held.
+        """
+        index, membership, tombstones = self._read_generation(generation, self.mmap)
+        delta = faiss.IndexIDMap(faiss.IndexFlatL2(index.d)) if self.mmap else None
+        replayed, log_offset = self.persistence.replay(
+            delta if delta is not None else index,
+            known_ids=KnownIds(membership, tombstones),
+            on_replay=membership.add,
+            on_remove=lambda ids: tombstone_ids(membership, tombstones, ids),
+        )
+        self.index, self.delta, self.membership, self.tombstones = index, delta, membership, tombstones
+        self.generation, self._log_offset, self._checked_at = generation, log_offset, time.monotonic()
+        return replayed
+
+    def load(self):
+        replayed = 0
+        with self.lock:
+            if self.generations is None:
+                self.index, self.membership, self.tombstones = self.index_factory(), IndexMembership(), set()
+                return self
+
+            with self.persistence.shared():
+                replayed = self._load_generation(self.generations.current())
+            mode = "memory-mapped" if self.mmap else "in memory"
+            logger.info(f"FAISS partition {self.scope} generation {self.generation} loaded {mode}")
+        if replayed:
+            self.persistence.mark_dirty()
+        return self
+
+    def refresh(self, force=False):
+        """
+        Picks up changes made by other workers: swaps in a newer published generation, or replays
+        changes appended to the shared log since the last check. Checks at most every reload_interval
+        seconds unless forced. Returns True if anything changed.
+        """
+        if self.persistence is None:
+            return False
+        if not force and time.monotonic() - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = time.monotonic()
+
+        with self.lock, self.persistence.shared():
+            generation = self.generations.current()
+            if generation != self.generation:
+                previous = self.generation
+                self._load_generation(generation)
+                metrics.increment("faiss.reloads")
+                logger.info(f"FAISS partition {self.scope} reloaded: generation {previous} -> {generation}")
+                return True
+
+            if self.persistence.log_size() <= self._log_offset:
+                return False
+            replayed, self._log_offset = self.persistence.replay(
+                self._writable_index(),
+                known_ids=KnownIds(self.membership, self.tombstones),
+                on_replay=self.membership.add,
+                on_remove=lambda ids: tombstone_ids(self.membership, self.tombstones, ids),
+                offset=self._log_offset,
+            )
+            return replayed > 0
+
+    def _publish(self, replacement=None, replay_log=True):
+        """
+        Publishes the next generation: the latest published one (or replacement) plus every change logged
+        by any worker. The partition then serves the new generation.
+        """
+        with self.lock, self.persistence.exclusive():
+            if replacement is not None:
+                index, membership, tombstones = replacement
+            else:
+                index, membership, tombstones = self._read_generation(self.generations.current())
+                if not membership.complete and self.membership.complete:
+                    membership = membership.with_doc_keys(self.membership.chunk_docs)
+            if replay_log:
+                self.persistence.replay(
+                    index,
+                    known_ids=KnownIds(membership, tombstones),
+                    on_replay=membership.add,
+                    on_remove=lambda ids: tombstone_ids(membership, tombstones, ids),
+                )
+
+            def write_sidecars(generation_path):
+                membership.save(f"{generation_path}.ids.npy")
+                save_tombstones(tombstones, f"{generation_path}.tombstones.npy")
+
+            generation = self.generations.publish(index, write_sidecars)
+            self.persistence.truncate_log()
+
+            delta = None
+            if self.mmap:
+                # Serve the published file itself so its pages are shared with the other workers
+                index = faiss.read_index(self.generations.file_for(generation), self.mmap_flags)
+                if self.configure_index is not None:
+                    self.configure_index(index)
+                delta = faiss.IndexIDMap(faiss.IndexFlatL2(index.d))
+            self.index, self.delta, self.membership, self.tombstones, self.generation = index, delta, membership, tombstones, generation
+            self._log_offset = 0
+        logger.info(f"FAISS partition {self.scope} published generation {generation}")
+
+    def ensure_membership(self, loader):
+        """
+        Reloads document keys from loader(scope) -> (chunk_ids, doc_keys) if they aren't known yet.
+        """
+        if self.membership.complete or loader is None:
+            return
+        ids, doc_keys = loader(self.scope)
+        lookup = dict(zip(ids, doc_keys))
+        with self.lock:
+            if not self.membership.complete:
+                self.membership = self.membership.with_doc_keys(lookup, force=True)
+        if self.persistence is not None:
+            self.persistence.mark_dirty()
+
+    @property
+    def ntotal(self):
+        return sum(index.ntotal for index in (self.index, self.delta) if index is not None)
+
+    @property
+    def tombstone_ratio(self):
+        ntotal = self.ntotal
+        return len(self.tombstones) / ntotal if ntotal else 0.0
+
+    def add(self, ids, vectors, doc_keys):
+        should_flush = False
+        with self.lock:
+            # Logged first and under the lock, so a concurrent publish either includes the add or never sees it
+            if self.persistence is not None:
+                should_flush = self.persistence.record_add(ids, vectors, doc_keys)
+            self._writable_index().add_with_ids(vectors, ids)
+            self.membership.add(ids, doc_keys)
+            if self._rebuild_adds is not None:
+                self._rebuild_adds.append((ids, vectors, doc_keys))
+        if should_flush:
+            self.flush()
+
+    def remove(self, ids):
+        """
+        Tombstones the given chunk ids so they are no longer returned by search. Returns how many were indexed.
+        """
+        with self.lock:
+            ids = np.array([chunk_id for chunk_id in np.asarray(ids).tolist() if self.membership.contains_chunk(chunk_id)], dtype='int64')
+            if not len(ids):
+                return 0
+            if self.persistence is not None:
+                self.persistence.record_remove(ids)
+            tombstone_ids(self.membership, self.tombstones, ids)
+        return len(ids)
+
+    def _tombstone_selector(self):
+        """
+        Returns a FAISS selector rejecting the tombstoned ids, or None without tombstones.
+        Must be called with the partition lock held.
+        """
+        if not self.tombstones:
+            return None
+        # Tombstone sets only grow until they are replaced, so their identity and size tell if they changed
+        if self._exclusion is None or self._exclusion[0] is not self.tombstones or self._exclusion[1] != len(self.tombstones):
+            dead = faiss.IDSelectorBatch(np.fromiter(self.tombstones, dtype='int64', count=len(self.tombstones)))
+            # The Python wrappers don't keep the inner selector alive, so both are held here
+            self._exclusion = (self.tombstones, len(self.tombstones), (faiss.IDSelectorNot(dead), dead))
+        return self._exclusion[2][0]
+
+    def search(self, vectors, k):
+        # Under the lock: FAISS doesn't support searching an index while another thread adds to it,
+        # which add() and the log replay in refresh() do in place
+        with self.lock:
+            sources = [index for index in (self.index, self.delta) if index is not None and index.ntotal]
+            if not sources:
+                return np.empty((len(vectors), 0), dtype='float32'), np.empty((len(vectors), 0), dtype='int64')
+
+            # Tombstoned ids are filtered inside FAISS, so k live results come back without over-fetching
+            selector = self._tombstone_selector()
+            results = [
+                index.search(vectors, min(k, index.ntotal), params=search_parameters(index, selector) if selector else None)
+                for index in sources
+            ]
+        distances = np.hstack([result[0] for result in results])
+        ids = np.hstack([result[1] for result in results])
+        if len(results) > 1:
+            order = np.argsort(distances, axis=1)
+            distances = np.take_along_axis(distances, order, axis=1)
+            ids = np.take_along_axis(ids, order, axis=1)
+        return distances, ids
+
+    def begin_rebuild(self):
+        """
+        Starts recording adds so a replacement index built from the stored vectors doesn't lose them.
+        """
+        with self.lock:
+            self._rebuild_adds = []
+
+    def replace(self, new_index, ids, doc_keys):
+        """
+        Swaps in a rebuilt index (holding the given chunk ids) and publishes it immediately.
+        Adds made since begin_rebuild() are carried over, as are tombstones for ids the new index still holds.
+        """
+        membership = IndexMembership()
+        membership.add(ids, doc_keys)
+        with self.lock:
+            for add_ids, vectors, add_doc_keys in self._rebuild_adds or []:
+                missing = np.array([not membership.contains_chunk(chunk_id) for chunk_id in add_ids.tolist()], dtype=bool)
+                if missing.any():
+                    new_index.add_with_ids(vectors[missing], add_ids[missing])
+                    membership.add(add_ids[missing], add_doc_keys[missing])
+            tombstones = set()
+            tombstone_ids(membership, tombstones, list(self.tombstones))
+            self._rebuild_adds = None
+            if self.persistence is None:
+                self.index, self.membership, self.tombstones = new_index, membership, tombstones
+                return
+        self._publish(replacement=(new_index, membership, tombstones))
+
+    def reset(self):
+        if self.persistence is None:
+            with self.lock:
+                self.index, self.membership, self.tombstones = self.index_factory(), IndexMembership(), set()
+            return
+        self._publish(replacement=(self.index_factory(), IndexMembership(), set()), replay_log=False)
+
+    def flush(self):
+        if self.persistence is not None:
+            return self.persistence.flush()
+        return False
+
+
+class PartitionedIndex:
+    """
+    A set of per-scope FAISS partitions (general, one per department, one per user).
+
+    Each partition is stored in its own file derived from the base index path, so a query only
+    searches the partitions the caller can access and the results are merged by distance.
+    """
+
+    def __init__(self, base_path, index_factory, flush_interval=30, flush_every=500, membership_loader=None,
+                 configure_index=None, mmap=False, reload_interval=2, mmap_flags=None):
+        self.base_path = base_path
+        self.mmap = mmap
+        self.mmap_flags = mmap_flags
+        self.reload_interval = reload_interval
+        self.index_factory = index_factory
+        self.membership_loader = membership_loader
+        self.configure_index = configure_index
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.partitions = {}
+        self._partitions_lock = threading.Lock()
+        self._flusher = None
+        self._flusher_pid = None
+        atexit.register(self.flush_all)
+
+    def partition_path(self, scope):
+        if not self.base_path:
+            return None
+        base, ext = os.path.splitext(self.base_path)
+        return f"{base}.{scope.replace(':', '_')}{ext or '.index'}"
+
+    def get(self, scope, create=True):
+        """
+        Returns the partition for a scope, loading it from disk (or creating it) on first use.
+        """
+        partition = self.partitions.get(scope)
+        if partition is not None or not create:
+            # Partitions loaded before a fork (gunicorn --preload) need this process's own flusher
+            self._ensure_flusher()
+            return partition
+
+        with self._partitions_lock:
+            partition = self.partitions.get(scope)
+            if partition is None:
+                partition = IndexPartition(
+                    scope, self.partition_path(scope), self.index_factory, self.flush_every, self.configure_index,
+                    self.mmap, self.reload_interval, self.mmap_flags
+                ).load()
+                self.partitions[scope] = partition
+        self._ensure_flusher()
+        return partition
+
+    def load(self, scopes):
+        for scope in scopes:
+            self.get(scope)
+
+    def add(self, scope, ids, vectors, doc_keys):
+        self.get(scope).add(ids, vectors, doc_keys)
+
+    def _on_disk(self, scope):
+        # A partition another worker has only logged changes for counts too
+        path = self.partition_path(scope)
+        return any(os.path.exists(f"{path}{suffix}") for suffix in ("", ".generation", ".wal"))
+
+    def _existing(self, scope):
+        """
+        Returns the partition for a scope if it exists here or on disk, refreshed with other workers' changes.
+        """
+        self._ensure_flusher()
+        partition = self.partitions.get(scope)
+        if partition is None:
+            if self.base_path and self._on_disk(scope):
+                partition = self.get(scope)
+        else:
+            partition.refresh()
+        return partition
+
+    def remove(self, scope, ids):
+        """
+        Tombstones chunk ids in a scope's partition. Returns how many of them were indexed.
+        """
+        partition = self._existing(scope)
+        if partition is None:
+            return 0
+        return partition.remove(ids)
+
+    def contains_document(self, doc_key, scope):
+        """
+        Constant-time check whether any chunk of a document is in the scope's partition.
+        """
+        partition = self._existing(scope)
+        if partition is None:
+            return False
+        partition.ensure_membership(self.membership_loader)
+        return partition.membership.contains_document(doc_key)
+
+    def missing_documents(self, doc_keys, scope):
+        """
+        Returns the document keys that have no chunk in the scope's partition.
+        """
+        partition = self._existing(scope)
+        if partition is None:
+            return list(doc_keys)
+        partition.ensure_membership(self.membership_loader)
+        return partition.membership.missing_documents(doc_keys)
+
+    def search(self, vectors, scopes, k):
+        """
+        Searches the given scopes and returns the k nearest (distance, id, scope) hits across them.
+        Partitions that don't exist on disk yet are skipped rather than created.
+        """
+        hits = []
+        for scope in scopes:
+            partition = self._existing(scope)
+            if partition is None:
+                continue
+            distances, ids = partition.search(vectors, k)
+            for distance, chunk_id in zip(distances[0].tolist(), ids[0].tolist()):
+                if chunk_id != -1:
+                    hits.append((distance, chunk_id, scope))
+        return heapq.nsmallest(k, hits)
+
+    def replace(self, scope, new_index, ids, doc_keys):
+        self.get(scope).replace(new_index, ids, doc_keys)
+
+    def reset(self):
+        for partition in list(self.partitions.values()):
+            partition.reset()
+
+    def counts(self):
+        """
+        Returns the number of vectors, documents and tombstones held by each loaded partition.
+        """
+        return {
+            scope: {
+                "vectors": partition.ntotal,
+                "documents": partition.membership.document_count,
+                "tombstones": len(partition.tombstones),
+                "tombstone_ratio": round(partition.tombstone_ratio, 4),
+                "generation": partition.generation,
+            }
+            for scope, partition in self.partitions.items()
+        }
+
+    def refresh_all(self):
+        for partition in list(self.partitions.values()):
+            try:
+                partition.refresh(force=True)
+            except Exception as e:
+                logger.error(f"Failed to refresh FAISS partition {partition.scope}: {e}", exc_info=True)
+
+    def flush_all(self):
+        for partition in list(self.partitions.values()):
+            try:
+                partition.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush FAISS partition {partition.scope}: {e}", exc_info=True)
+
+    def _ensure_flusher(self):
+        if self.flush_interval <= 0 or not self.base_path:
+            return
+        if self._flusher is not None and self._flusher_pid == os.getpid() and self._flusher.is_alive():
+            return
+        with self._partitions_lock:
+            if self._flusher is not None and self._flusher_pid == os.getpid() and self._flusher.is_alive():
+                return
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(target=self._run_flusher, name="faiss-flusher", daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        # Idle workers also converge: refresh on every tick, flush every flush_interval
+        stop = threading.Event()
+        tick = min(self.flush_interval, self.reload_interval) if self.reload_interval > 0 else self.flush_interval
+        last_flush = time.monotonic()
+        while not stop.wait(tick):
+            if self.reload_interval > 0:
+                self.refresh_all()
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush_all()
+                last_flush = time.monotonic()
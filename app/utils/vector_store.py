@@ -0,0 +1,93 @@
+import numpy as np
+from sqlalchemy import or_, func
+from .config import config
+from app.models.database import db
+from app.models.document import DocumentChunk
+from app.utils.embedding_batcher import embed_texts
+from app.utils.logger import logger
+
+
+def current_model_version():
+    """
+    Tag stored next to every vector; vectors with another tag are re-encoded on rebuild.
+    """
+    return config.EMBEDDING_MODEL_VERSION or config.HUGGING_FACE_TRANSFORMER
+
+
+def vector_to_bytes(vector):
+    return np.asarray(vector, dtype='<f4').tobytes()
+
+
+def bytes_to_vector(data):
+    return np.frombuffer(data, dtype='<f4')
+
+
+def store_chunk_embeddings(chunks, embeddings):
+    """
+    Attaches embeddings to chunk rows (added to the session, not committed).
+    """
+    model_version = current_model_version()
+    for chunk, embedding in zip(chunks, embeddings):
+        chunk.embedding = vector_to_bytes(embedding)
+        chunk.embedding_model = model_version
+
+
+def backfill_missing_embeddings(batch_size=None):
+    """
+    Encodes chunks that have no stored vector, or one from another model version.
+    Returns the number of chunks encoded.
+    """
+    batch_size = batch_size or config.EMBEDDING_BATCH_SIZE
+    model_version = current_model_version()
+    encoded = 0
+    while True:
+        chunks = DocumentChunk.query.filter(
+            or_(DocumentChunk.embedding.is_(None), DocumentChunk.embedding_model != model_version)
+        ).order_by(DocumentChunk.id).limit(batch_size).all()
+        if not chunks:
+            break
+
+        store_chunk_embeddings(chunks, embed_texts([chunk.content for chunk in chunks]))
+        db.session.commit()
+        encoded += len(chunks)
+        logger.info(f"Encoded {encoded} chunks without a stored {model_version} vector")
+    return encoded
+
+
+def _stored_vectors(query):
+    query = query if query is not None else DocumentChunk.query
+    return query.filter(
+        DocumentChunk.embedding.isnot(None),
+        DocumentChunk.embedding_model == current_model_version()
+    )
+
+
+def sample_stored_embeddings(limit, query=None):
+    """
+    Returns a random sample of up to limit stored vectors (for training quantized indexes), as a float32 matrix.
+    """
+    rows = _stored_vectors(query).with_entities(DocumentChunk.embedding).order_by(func.random()).limit(limit).all()
+    if not rows:
+        return np.empty((0, 0), dtype='float32')
+    return np.vstack([bytes_to_vector(embedding) for (embedding,) in rows]).astype('float32')
+
+
+def iter_stored_embeddings(batch_size=10000, query=None):
+    """
+    Streams (ids, vectors, doc_keys) numpy batches of stored chunk vectors for the current model version, ordered by id.
+    An optional DocumentChunk query narrows the rows read.
+    """
+    rows = _stored_vectors(query).with_entities(
+        DocumentChunk.id, DocumentChunk.embedding, DocumentChunk.doc_key
+    ).order_by(DocumentChunk.id).execution_options(stream_results=True, yield_per=batch_size)
+
+    ids, vectors, doc_keys = [], [], []
+    for chunk_id, embedding, doc_key in rows:
+        ids.append(chunk_id)
+        vectors.append(bytes_to_vector(embedding))
+        doc_keys.append(doc_key)
+        if len(ids) >= batch_size:
+            yield np.array(ids, dtype='int64'), np.vstack(vectors).astype('float32'), np.array(doc_keys, dtype='int64')
+            ids, vectors, doc_keys = [], [], []
+    if ids:
+        yield np.array(ids, dtype='int64'), np.vstack(vectors).astype('float32'), np.array(doc_keys, dtype='int64')
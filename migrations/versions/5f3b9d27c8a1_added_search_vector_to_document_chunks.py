@@ -0,0 +1,35 @@
+"""added search_vector to document_chunks
+
+Revision ID: 5f3b9d27c8a1
+Revises: a83d5c1e9b27
+Create Date: 2026-10-18 14:02:37.514208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3b9d27c8a1'
+down_revision = 'a83d5c1e9b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Stored generated column: existing rows are filled in by Postgres when it is added
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'search_vector',
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('english', coalesce(section, '') || ' ' || content)", persisted=True),
+            nullable=True
+        ))
+        batch_op.create_index('ix_document_chunks_search_vector', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.drop_index('ix_document_chunks_search_vector', postgresql_using='gin')
+        batch_op.drop_column('search_vector')
@@ -0,0 +1,28 @@
+"""added summary and summarized_through to chats
+
+Revision ID: 8b2e61f4a7d3
+Revises: 5f3b9d27c8a1
+Create Date: 2026-10-18 16:21:09.304117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e61f4a7d3'
+down_revision = '5f3b9d27c8a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('chats', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('summarized_through', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('chats', schema=None) as batch_op:
+        batch_op.drop_column('summarized_through')
+        batch_op.drop_column('summary')
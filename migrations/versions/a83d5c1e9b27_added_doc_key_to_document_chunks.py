@@ -0,0 +1,59 @@
+"""added doc_key to document_chunks
+
+Revision ID: a83d5c1e9b27
+Revises: e2f95b07a6d4
+Create Date: 2026-10-18 12:41:08.291574
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83d5c1e9b27'
+down_revision = 'e2f95b07a6d4'
+branch_labels = None
+depends_on = None
+
+
+# Must match TABLE_TAGS in app/utils/document_locator.py
+TABLE_TAGS = {
+    'documents': 1,
+    'general_documents': 2,
+    'hr_documents': 3,
+    'it_documents': 4,
+    'reconciliation_documents': 5,
+    'marketing_documents': 6,
+    'transformation_documents': 7,
+    'communication_documents': 8,
+    'internal_operation_documents': 9,
+    'legal_documents': 10,
+    'account_documents': 11,
+    'portfolio_risk_documents': 12,
+    'underwriter_documents': 13,
+    'business_operation_documents': 14,
+    'client_experience_documents': 15,
+    'recovery_documents': 16,
+    'product_documents': 17,
+    'sales_documents': 18,
+}
+
+
+def upgrade():
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('doc_key', sa.BigInteger(), nullable=True))
+
+    for table, tag in TABLE_TAGS.items():
+        op.execute(
+            f"UPDATE document_chunks SET doc_key = ({tag}::bigint << 32) | document_id WHERE document_table = '{table}'"
+        )
+
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.alter_column('doc_key', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_document_chunks_doc_key'), ['doc_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_document_chunks_doc_key'))
+        batch_op.drop_column('doc_key')
@@ -0,0 +1,61 @@
+"""added scope to document_chunks
+
+Revision ID: e2f95b07a6d4
+Revises: 4c1a8e6f2d93
+Create Date: 2026-10-18 11:26:50.730862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f95b07a6d4'
+down_revision = '4c1a8e6f2d93'
+branch_labels = None
+depends_on = None
+
+
+DEPARTMENT_TABLES = {
+    'hr_documents': 'hr',
+    'it_documents': 'it',
+    'reconciliation_documents': 'reconciliation',
+    'marketing_documents': 'marketing',
+    'transformation_documents': 'transformation',
+    'communication_documents': 'communication',
+    'internal_operation_documents': 'internal_operations',
+    'legal_documents': 'legal',
+    'account_documents': 'accounts',
+    'portfolio_risk_documents': 'portfolio_risk',
+    'underwriter_documents': 'underwriting',
+    'business_operation_documents': 'business_operations',
+    'client_experience_documents': 'client_experience',
+    'recovery_documents': 'recovery',
+    'product_documents': 'product',
+    'sales_documents': 'sales',
+}
+
+
+def upgrade():
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('scope', sa.String(length=100), nullable=True))
+
+    # Backfill the access scope of existing chunks from the table (and owner) of their document
+    op.execute("UPDATE document_chunks SET scope = 'general' WHERE document_table = 'general_documents'")
+    for table, department in DEPARTMENT_TABLES.items():
+        op.execute(f"UPDATE document_chunks SET scope = 'dept:{department}' WHERE document_table = '{table}'")
+    op.execute(
+        "UPDATE document_chunks SET scope = COALESCE('user:' || documents.user_id, 'unassigned') "
+        "FROM documents WHERE document_chunks.document_table = 'documents' AND documents.id = document_chunks.document_id"
+    )
+    op.execute("UPDATE document_chunks SET scope = 'unassigned' WHERE scope IS NULL")
+
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.alter_column('scope', existing_type=sa.String(length=100), nullable=False)
+        batch_op.create_index(batch_op.f('ix_document_chunks_scope'), ['scope'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('document_chunks', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_document_chunks_scope'))
+        batch_op.drop_column('scope')